@@ -4,12 +4,42 @@ Public interface.
 See documentation in the respective source files.
 """
 
+import sys
+
 from .version import __version__
 
 # classes
+from .cache import DirectoryCache
+from .cache import MemoryCache
+from .cache import SqliteCache
+from .index import HashIndex
 from .main import FilenameBuilder
+from .main import SearchResult
+from .main import StreamHasher
 from .main import SubtitleArchive
 from .main import UserAgent
+from .main import WarmOpener
+from .store import ContentStore
+
+# exceptions
+from .main import ArchiveLimitExceeded
+from .main import PartMismatch
+
+if sys.version_info >= (3, 6):
+    from .aio import AsyncSubtitleArchive
+    from .aio import AsyncUserAgent
 
 # functions
+from .bulk import extract_many
+from .bulk import hash_files
+from .bulk import process_executor
+from .cache import open_cache
+from .index import find_duplicates
+from .main import default_opener
 from .main import hash_file
+from .main import hash_parts
+from .main import hash_path
+from .main import hash_stream
+from .main import hash_url
+from .main import hash_urls
+from .main import rank_search_results
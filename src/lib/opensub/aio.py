@@ -0,0 +1,325 @@
+"""
+Asyncio counterparts of UserAgent and SubtitleArchive. Python 3.6+ only.
+
+Network I/O runs on the event loop via a minimal HTTP/1.1 client built on
+asyncio streams (no proxy support). File hashing, zip decoding, file
+writes and cache access are offloaded to the loop's default executor.
+"""
+
+import asyncio
+import functools
+import logging
+import ssl
+import tempfile
+import time
+import urllib.parse
+
+from .main import SubtitleArchive
+from .main import UserAgent
+from .main import _SearchPageParser
+
+
+_BUF_SIZE = 64 * 1024  # bytes
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+def _headers_of(opener):
+
+    """Reuse the default headers (e.g. User-Agent) of a urllib opener."""
+
+    return list(getattr(opener, "addheaders", []))
+
+
+async def _read_headers(reader):
+
+    headers = dict()
+    while True:
+        line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+        if not line:
+            return headers
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _read_chunked(reader):
+
+    while True:
+        size_line = await reader.readline()
+        size = int(size_line.split(b";")[0], 16)
+        if size == 0:
+            await _read_headers(reader)  # trailers
+            return
+        yield await reader.readexactly(size)
+        await reader.readexactly(2)  # CRLF
+
+
+async def http_get(url, headers=(), max_redirects=5):
+
+    """
+    Async generator of the body of an HTTP GET response.
+
+    Takes:
+        url - http(s) URL
+        headers - iterable of (name, value) pairs to send
+        max_redirects - follow this many redirects at most
+
+    Yields:
+        body as chunks of bytes
+
+    Raises:
+        Exception - non-2xx response
+    """
+
+    for _ in range(max_redirects + 1):
+
+        parts = urllib.parse.urlsplit(url)
+        https = parts.scheme == "https"
+        port = parts.port or (443 if https else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port,
+            ssl=ssl.create_default_context() if https else None)
+
+        try:
+            lines = ["GET {} HTTP/1.1".format(path),
+                     "Host: {}".format(parts.netloc),
+                     "Connection: close"]
+            lines.extend("{}: {}".format(*header) for header in headers)
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+            status_line = (await reader.readline()).decode("latin-1")
+            status = int(status_line.split()[1])
+            response_headers = await _read_headers(reader)
+
+            if status in _REDIRECT_CODES:
+                url = urllib.parse.urljoin(url, response_headers["location"])
+                logging.debug("redirected to: {}".format(url))
+                continue
+
+            if not 200 <= status < 300:
+                raise Exception("http error {}: {}".format(status, url))
+
+            if response_headers.get("transfer-encoding") == "chunked":
+                async for chunk in _read_chunked(reader):
+                    yield chunk
+
+            elif "content-length" in response_headers:
+                remaining = int(response_headers["content-length"])
+                while remaining > 0:
+                    chunk = await reader.read(min(remaining, _BUF_SIZE))
+                    if not chunk:
+                        raise Exception("truncated response: {}".format(url))
+                    remaining -= len(chunk)
+                    yield chunk
+
+            else:
+                while True:
+                    chunk = await reader.read(_BUF_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+            return
+
+        finally:
+            writer.close()
+
+    raise Exception("too many redirects: {}".format(url))
+
+
+class AsyncUserAgent(UserAgent):
+
+    """
+    Communicate with subtitle servers without blocking the event loop.
+
+    Same constructor as UserAgent. Of the opener only its addheaders
+    are used. Searches are hedged on the mirrors like UserAgent does,
+    but the losing requests are cancelled right away.
+    """
+
+    async def _fetch_search_page(self, server, url_kwargs):
+
+        """Returns: search page from server."""
+
+        started = time.time()
+        try:
+            chunks = [chunk async for chunk in http_get(
+                self._search_page_url(server=server, **url_kwargs),
+                headers=_headers_of(self.opener))]
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.health[server].failed()
+            raise
+
+        self.health[server].succeeded(time.time() - started)
+        return b"".join(chunks)
+
+    async def _hedged_fetch_search_page(self, **url_kwargs):
+
+        """Same as UserAgent._hedged_fetch_search_page(), but a coroutine."""
+
+        servers = self.servers()
+        pending = {asyncio.ensure_future(
+            self._fetch_search_page(servers[0], url_kwargs))}
+        launched = 1
+        failures = 0
+
+        try:
+            while True:
+
+                delay = None
+                if launched < len(servers):
+                    delay = self.hedge_delay
+                    if delay is None:
+                        delay = self.health[servers[launched - 1]].p95()
+
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=delay,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    logging.info("hedging search on: {}".format(
+                        servers[launched]))
+                    pending.add(asyncio.ensure_future(
+                        self._fetch_search_page(
+                            servers[launched], url_kwargs)))
+                    launched += 1
+                    continue
+
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+
+                    logging.warning("search failed: {}".format(error))
+                    failures += 1
+                    if failures == len(servers):
+                        raise error
+                    if launched < len(servers):
+                        pending.add(asyncio.ensure_future(
+                            self._fetch_search_page(
+                                servers[launched], url_kwargs)))
+                        launched += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def search(self, movie, language, movie_hash=None):
+
+        """Same as UserAgent.search(), but a coroutine."""
+
+        loop = asyncio.get_event_loop()
+        if movie_hash is None:
+            movie_hash = await loop.run_in_executor(
+                None, self._hash_movie, movie)
+
+        url_kwargs = dict(
+            language=language,
+            movie_hash=movie_hash,
+            cd_count=len(movie),
+            )
+
+        key = self._search_cache_key(**url_kwargs)
+        page = await loop.run_in_executor(None, self._load_search_page, key)
+        if page is not None:
+            parser = _SearchPageParser()
+            parser.feed(page)
+            return parser.close()
+
+        parser = _SearchPageParser()
+        chunks = list()
+        if self.mirrors:
+            chunks.append(await self._hedged_fetch_search_page(**url_kwargs))
+            parser.feed(chunks[0])
+        else:
+            async for chunk in http_get(
+                self._search_page_url(**url_kwargs),
+                headers=_headers_of(self.opener)):
+
+                parser.feed(chunk)
+                chunks.append(chunk)
+
+        results = parser.close()
+        if results:
+            await loop.run_in_executor(
+                None, self._save_search_page, key, b"".join(chunks))
+
+        return results
+
+
+class AsyncSubtitleArchive(SubtitleArchive):
+
+    """
+    Access subtitles in a subtitle archive without blocking the event loop.
+
+    Same constructor as SubtitleArchive. Of the opener only its addheaders
+    are used. Use it as an async context manager:
+
+        async with AsyncSubtitleArchive(url) as archive:
+            await archive.extract(...)
+
+    yield_open() may be used after download() has been awaited.
+    """
+
+    async def __aenter__(self):
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+
+        self.__exit__(exc_type, exc_value, traceback)
+
+    async def download(self):
+
+        """Download the archive to a temporary file, unless already done."""
+
+        if self.tempfile is not None:
+            return
+
+        loop = asyncio.get_event_loop()
+        if await loop.run_in_executor(None, self._load_from_cache):
+            return
+
+        dst = tempfile.NamedTemporaryFile()
+        size = 0
+        try:
+            async for chunk in http_get(
+                self.url, headers=_headers_of(self.opener)):
+
+                size += len(chunk)
+                self._check_archive_size(size)
+                await loop.run_in_executor(None, dst.write, chunk)
+
+            await loop.run_in_executor(None, dst.flush)
+        except BaseException:
+            dst.close()
+            raise
+
+        dst.seek(0)
+        self.tempfile = dst
+        await loop.run_in_executor(None, self._save_to_cache)
+
+    async def extract(
+        self, movie, builder, overwrite=False, store=None, pairs=None):
+
+        """Same as SubtitleArchive.extract(), but a coroutine."""
+
+        await self.download()
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                SubtitleArchive.extract,
+                self,
+                movie=movie,
+                builder=builder,
+                overwrite=overwrite,
+                store=store,
+                pairs=pairs,
+                ))
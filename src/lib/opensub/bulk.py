@@ -0,0 +1,380 @@
+"""
+Hash many local files at once.
+
+On spinning disks hashing files in argument order makes the heads jump
+back and forth across the platter. Here the reads of a batch are ordered
+by their physical location on the device (FIEMAP, where the filesystem
+supports it, inode number otherwise), while the results are still
+reported in the requested order.
+
+On fast storage the work is bound by the CPU instead, and threads don't
+help because of the GIL. hash_files() and extract_many() can spread it
+across worker processes.
+"""
+
+import array
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import concurrent.futures
+    from concurrent.futures.process import BrokenProcessPool
+except ImportError:
+    # python2: no worker processes
+    concurrent = None
+
+from .main import _HASH_CHUNK_SIZE
+from .main import _hash_cache_key
+from .main import _izip
+from .main import FilenameBuilder
+from .main import SubtitleArchive
+from .main import default_opener
+from .main import hash_file
+from .version import __version__
+
+
+# linux/fs.h, linux/fiemap.h
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER_FMT = "=QQLLLL"  # start, length, flags, mapped, count, rsvd
+_FIEMAP_EXTENT_FMT = "=QQQQQLLLL"  # logical, physical, length, ..., flags
+
+
+def _physical_offset(fd):
+
+    """
+    Returns:
+        offset of the first byte of the file on its device, or
+        None if unknown (no FIEMAP support, empty file, etc)
+    """
+
+    if fcntl is None:
+        return None
+
+    header_size = struct.calcsize(_FIEMAP_HEADER_FMT)
+    # python2's ioctl takes no bytearray, an array works on both
+    buf = array.array("B",
+        struct.pack(_FIEMAP_HEADER_FMT, 0, 1, 0, 0, 1, 0)
+        + b"\0" * struct.calcsize(_FIEMAP_EXTENT_FMT))
+
+    try:
+        fcntl.ioctl(fd, _FS_IOC_FIEMAP, buf, True)
+    except (IOError, OSError):
+        return None
+
+    mapped_extents = struct.unpack_from(_FIEMAP_HEADER_FMT, buf)[3]
+    if mapped_extents == 0:
+        return None
+
+    return struct.unpack_from(_FIEMAP_EXTENT_FMT, buf, header_size)[1]
+
+
+def _fadvise(fd, offset, length, advice_name):
+
+    """posix_fadvise() if the platform has it, a no-op otherwise."""
+
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def _plan(path):
+
+    """
+    Returns:
+        (locality key, stat) of path
+    """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        stat = os.fstat(fd)
+        physical = _physical_offset(fd)
+    finally:
+        os.close(fd)
+
+    if physical is None:
+        key = (stat.st_dev, 1, stat.st_ino)
+    else:
+        key = (stat.st_dev, 0, physical)
+
+    return key, stat
+
+
+def _hash_uncached(path, file_size):
+
+    """Hash path without leaving its chunks in the page cache."""
+
+    with open(path, "rb") as file_:
+        fd = file_.fileno()
+        tail = max(file_size - _HASH_CHUNK_SIZE, 0)
+
+        # Let the kernel queue both reads of the file together.
+        _fadvise(fd, 0, _HASH_CHUNK_SIZE, "POSIX_FADV_WILLNEED")
+        _fadvise(fd, tail, _HASH_CHUNK_SIZE, "POSIX_FADV_WILLNEED")
+
+        try:
+            return hash_file(file_, file_size=file_size)
+        finally:
+            _fadvise(fd, 0, _HASH_CHUNK_SIZE, "POSIX_FADV_DONTNEED")
+            _fadvise(fd, tail, _HASH_CHUNK_SIZE, "POSIX_FADV_DONTNEED")
+
+
+def _picklable(error):
+
+    """Returns: error, or a plain Exception if it can't leave a worker."""
+
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return Exception(str(error))
+
+
+def _hash_or_error(task):
+
+    """Returns: (hash, None) or (None, exception) for (path, file size)."""
+
+    path, file_size = task
+    try:
+        return _hash_uncached(path, file_size), None
+    except Exception as e:
+        return None, _picklable(e)
+
+
+def _chunksize(task_count, processes):
+
+    # a few chunks per worker: few round trips, still balanced
+    processes = processes or multiprocessing.cpu_count()
+    return max(1, task_count // (4 * processes))
+
+
+def process_executor(processes=None):
+
+    """
+    Returns:
+        concurrent.futures.ProcessPoolExecutor of processes workers
+        (default: a worker per CPU), to share across calls of
+        hash_files() and extract_many()
+    """
+
+    if concurrent is None:
+        raise Exception("worker processes need python 3")
+    return concurrent.futures.ProcessPoolExecutor(processes)
+
+
+def _map_chunk(func, tasks):
+
+    return [func(task) for task in tasks]
+
+
+def _map_or_error(executor, func, tasks, processes, failed):
+
+    """
+    Like executor.map(func, tasks), but a worker dying doesn't stop it:
+    each task it took down (and any not started yet, the pool is broken
+    for good) yields failed(BrokenProcessPool) instead.
+    """
+
+    chunksize = _chunksize(len(tasks), processes)
+    chunks = [tasks[start:start + chunksize]
+              for start in range(0, len(tasks), chunksize)]
+
+    futures = list()
+    for chunk in chunks:
+        try:
+            future = executor.submit(_map_chunk, func, chunk)
+        except BrokenProcessPool as e:
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+        futures.append(future)
+
+    try:
+        for chunk, future in _izip(chunks, futures):
+            try:
+                outcomes = future.result()
+            except BrokenProcessPool as e:
+                logging.debug("worker process died: {}".format(e))
+                outcomes = [failed(e) for _ in chunk]
+            for outcome in outcomes:
+                yield outcome
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _hash_failed(error):
+
+    return None, error
+
+
+def _hash_batch(paths, schedule, cache, executor=None, processes=None):
+
+    """Returns: (path, hash, size, error) for each of paths."""
+
+    results = [[path, None, None, None] for path in paths]
+    plan = list()
+
+    for idx, path in enumerate(paths):
+        try:
+            key, stat = _plan(path)
+        except Exception as e:
+            results[idx][3] = e
+            continue
+
+        results[idx][2] = stat.st_size
+        cache_key = _hash_cache_key(path, stat)
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                results[idx][1] = cached.decode("ascii")
+                continue
+
+        plan.append((key if schedule else idx, idx, stat.st_size, cache_key))
+
+    plan.sort()
+
+    tasks = [(paths[idx], file_size) for _, idx, file_size, _ in plan]
+    if executor is None:
+        outcomes = (_hash_or_error(task) for task in tasks)
+    else:
+        outcomes = _map_or_error(
+            executor, _hash_or_error, tasks, processes, _hash_failed)
+
+    for (_, idx, _, cache_key), (hash_, error) in _izip(plan, outcomes):
+        results[idx][1] = hash_
+        results[idx][3] = error
+        if hash_ is not None and cache is not None:
+            cache.set(cache_key, hash_.encode("ascii"))
+
+    return [tuple(result) for result in results]
+
+
+def hash_files(
+    paths, schedule=True, batch_size=1024, cache=None, processes=None,
+    executor=None, with_size=False):
+
+    """
+    Hash many local files, reading them in disk order.
+
+    Takes:
+        paths - iterable of file paths, consumed lazily batch by batch
+        schedule - order the reads of a batch by physical locality
+        batch_size - number of files whose reads are ordered together
+        cache - cache object (see opensub/cache.py), None for no caching
+        processes - number of worker processes to hash in, None to hash
+            in the calling process
+        executor - see process_executor(), to hash in its workers
+            instead of starting processes workers for this call only
+        with_size - yield the size of each file too, as seen when it
+            was hashed, sparing callers another stat
+
+    Yields:
+        (path, hash, error) tuples in the order of paths,
+        either hash or error (the exception raised) is None
+        (path, hash, size, error) tuples if with_size, size is None
+        if the file could not be opened
+        Files a worker process was lost with (e.g. killed) get a
+        BrokenProcessPool error.
+    """
+
+    own_executor = None
+    if executor is None and processes is not None:
+        executor = own_executor = process_executor(processes)
+
+    try:
+        paths = iter(paths)
+        while True:
+            batch = list(itertools.islice(paths, batch_size))
+            if not batch:
+                return
+            logging.debug("hashing batch of {} file(s)".format(len(batch)))
+            for path, hash_, size, error in _hash_batch(
+                batch, schedule, cache, executor, processes):
+
+                if with_size:
+                    yield path, hash_, size, error
+                else:
+                    yield path, hash_, error
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown(wait=False)
+
+
+def _extract_or_error(archive_kwargs, task):
+
+    """Returns: (files written, None) or (files written, exception)."""
+
+    url, movie, template, overwrite = task
+    archive = SubtitleArchive(
+        url=url, opener=default_opener(version=__version__), **archive_kwargs)
+    try:
+        with archive:
+            archive.extract(
+                movie=movie,
+                builder=FilenameBuilder(template),
+                overwrite=overwrite,
+                )
+    except Exception as e:
+        return archive.files_written, _picklable(e)
+    return archive.files_written, None
+
+
+def _extract_failed(error):
+
+    return [], error
+
+
+def extract_many(tasks, processes=None, executor=None, **archive_kwargs):
+
+    """
+    Download and extract many subtitle archives.
+
+    Takes:
+        tasks - iterable of (archive url, movie, template, overwrite)
+            tuples, see SubtitleArchive.extract() and FilenameBuilder
+        processes - number of worker processes to extract in, None to
+            extract in the calling process
+        executor - see process_executor(), to extract in its workers
+            instead of starting processes workers for this call only
+        archive_kwargs - pass down to SubtitleArchive, e.g. limits
+
+    Yields:
+        (task, files written, error) tuples in the order of tasks,
+        error is the exception raised or None
+        Archives a worker process was lost with (e.g. killed) get a
+        BrokenProcessPool error, files written by then are not known.
+    """
+
+    extract_one = functools.partial(_extract_or_error, archive_kwargs)
+    tasks = list(tasks)
+
+    if executor is None and processes is None:
+        for task in tasks:
+            yield (task,) + extract_one(task)
+        return
+
+    own_executor = None
+    if executor is None:
+        executor = own_executor = process_executor(processes)
+
+    try:
+        for task, outcome in _izip(tasks, _map_or_error(
+                executor, extract_one, tasks, processes, _extract_failed)):
+            yield (task,) + outcome
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown(wait=False)
@@ -0,0 +1,206 @@
+"""
+Caches of hashes, search pages and subtitle archives.
+
+Hashing, searching and downloading are repeated for the same files over
+and over when many workers process overlapping libraries. With a cache
+shared by the workers (a directory on a network filesystem, or a sqlite
+database on local disk for one host) each is done once.
+
+A cache is any object with these methods:
+
+    get(key) - Returns: value (bytes) stored for key (str), None if missing
+    set(key, value) - Store value (bytes) for key (str), replacing any
+
+Both must be safe to call from multiple threads. Caches may forget
+anything at any time: the ones here log their I/O errors as warnings
+and carry on as if the key was missing or not stored. Keys used here:
+
+    hash:<absolute path>:<size>:<mtime in ns>
+    search:<language>:<movie hash>:<cd count>
+    archive:<url>
+
+Only search pages with results are cached, so movies not found are looked
+up again later. Search pages are stored with the time of caching and
+expire (see UserAgent's search_ttl), so better subtitles uploaded later
+show up.
+"""
+
+import collections
+import errno
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+try:
+    _replace = os.replace
+except AttributeError:
+    # python2, rename replaces atomically on POSIX
+    _replace = os.rename
+
+
+class MemoryCache(object):
+
+    """In-memory cache of the least recently used max_items items."""
+
+    def __init__(self, max_items=1024):
+
+        self.max_items = max_items
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def set(self, key, value):
+
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class SqliteCache(object):
+
+    """Cache in a sqlite database file, shared by processes of a host."""
+
+    def __init__(self, path, timeout=30):
+
+        """
+        Takes:
+            path - path of database file, created if missing
+            timeout - seconds to wait for other writers
+        """
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache"
+                " (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def get(self, key):
+
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value FROM cache WHERE key = ?",
+                    (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning("can't read cache: {}".format(e))
+            return None
+        return None if row is None else bytes(row[0])
+
+    def set(self, key, value):
+
+        try:
+            with self._lock:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO cache (key, value)"
+                        " VALUES (?, ?)",
+                        (key, sqlite3.Binary(value)))
+        except sqlite3.Error as e:
+            logging.warning("can't write cache: {}".format(e))
+
+    def close(self):
+
+        self._db.close()
+
+
+class DirectoryCache(object):
+
+    """
+    Cache in a directory, a file per key, shared by any number of hosts.
+
+    Writers don't lock: each writes a temporary file and renames it to
+    its final name atomically. Readers see either no value or a complete
+    one. Concurrent writers of the same key write the same value anyway.
+    """
+
+    def __init__(self, root):
+
+        self.root = root
+
+        try:
+            os.makedirs(root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+
+        digest = hashlib.sha1(key.encode("utf8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def get(self, key):
+
+        try:
+            with open(self._path(key), "rb") as file_:
+                return file_.read()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                logging.warning("can't read cache: {}".format(e))
+            return None
+
+    def set(self, key, value):
+
+        try:
+            self._set(key, value)
+        except (IOError, OSError) as e:
+            logging.warning("can't write cache: {}".format(e))
+
+    def _set(self, key, value):
+
+        path = self._path(key)
+        try:
+            os.mkdir(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        tmp = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False)
+        try:
+            with tmp:
+                tmp.write(value)
+            # readable by the other users and hosts sharing the cache
+            os.chmod(tmp.name, 0o644)
+            _replace(tmp.name, path)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+
+
+def open_cache(spec):
+
+    """
+    Takes:
+        spec - one of:
+            memory or memory:<max items>
+            sqlite:<path of database file>
+            dir:<path of directory>
+
+    Returns:
+        cache object
+    """
+
+    kind, _, arg = spec.partition(":")
+
+    if kind == "memory":
+        return MemoryCache(int(arg)) if arg else MemoryCache()
+    if kind == "sqlite" and arg:
+        return SqliteCache(arg)
+    if kind == "dir" and arg:
+        return DirectoryCache(arg)
+
+    raise ValueError("invalid cache: {}".format(spec))
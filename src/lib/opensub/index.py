@@ -0,0 +1,125 @@
+"""
+Find duplicate video files by their hash.
+
+Meant for whole libraries of millions of files, so the index keeps hashes
+and sizes in flat arrays of 64 bit integers instead of a Python object
+per file. Only the paths are Python strings.
+
+Keep in mind that the hash finds copies of the same file only. Re-encoded
+or otherwise altered copies have different hashes.
+"""
+
+import array
+import itertools
+
+from .bulk import hash_files
+
+try:
+    array.array("Q")
+    _UINT64 = "Q"
+except ValueError:
+    # python2 has no "Q", but "L" is 64 bit on LP64 platforms
+    _UINT64 = "L"
+
+
+class HashIndex(object):
+
+    """Hashes and sizes of files, to group files with the same hash."""
+
+    def __init__(self):
+
+        self.hashes = array.array(_UINT64)
+        self.sizes = array.array(_UINT64)
+        self.paths = list()
+
+    def __len__(self):
+
+        return len(self.paths)
+
+    def add(self, path, hash_, size=0):
+
+        """
+        Takes:
+            path - path of file
+            hash_ - hash of file as hash_file() returns it
+            size - size of file in bytes, 0 if unknown
+        """
+
+        self.hashes.append(int(hash_, 16))
+        self.sizes.append(size)
+        self.paths.append(path)
+
+    def _buckets(self, bucket_size):
+
+        """
+        Distribute the indexes of the files into buckets by the top bits
+        of their hashes, so that the buckets are in the order of hashes.
+
+        Returns:
+            list of arrays of indexes
+        """
+
+        bits = 0
+        while (1 << bits) * bucket_size < len(self.hashes) and bits < 32:
+            bits += 1
+
+        buckets = [array.array(_UINT64) for _ in range(1 << bits)]
+        for idx, hash_ in enumerate(self.hashes):
+            buckets[hash_ >> (64 - bits) if bits else 0].append(idx)
+
+        return buckets
+
+    def duplicates(self, bucket_size=64 * 1024):
+
+        """
+        Takes:
+            bucket_size - files sorted at once, only these need a Python
+                object each, the rest stay in flat arrays
+
+        Yields:
+            (hash, [(path, size), ...]) for each hash shared by 2+ files,
+            in the order of hashes, files in the order they were added
+        """
+
+        for bucket in self._buckets(bucket_size):
+
+            order = sorted(bucket, key=self.hashes.__getitem__)
+
+            for hash_, group in itertools.groupby(
+                order, key=self.hashes.__getitem__):
+
+                group = list(group)
+                if len(group) > 1:
+                    yield ("{:016x}".format(hash_),
+                           [(self.paths[idx], self.sizes[idx])
+                            for idx in group])
+
+
+def find_duplicates(paths, index=None, cache=None):
+
+    """
+    Hash local files and group them by hash.
+
+    Takes:
+        paths - iterable of file paths
+        index - HashIndex to add to, a new one if None
+        cache - cache object for hashes (see opensub/cache.py)
+
+    Returns:
+        (index, errors) where errors is a list of (path, exception)
+        for the files that could not be hashed
+    """
+
+    if index is None:
+        index = HashIndex()
+    errors = list()
+
+    for path, hash_, size, error in hash_files(
+        paths, cache=cache, with_size=True):
+
+        if error is None:
+            index.add(path, hash_, size)
+        else:
+            errors.append((path, error))
+
+    return index, errors
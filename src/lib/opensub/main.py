@@ -1,14 +1,22 @@
 """See __init__.py for what is considered public here."""
 
+import collections
 import errno
+import io
 import itertools
+import json
 import logging
+import multiprocessing.pool
 import os
 import shutil
+import socket
 import struct
 import sys
 import tempfile
+import threading
+import time
 import xml.etree.ElementTree as etree
+import xml.parsers.expat
 import zipfile
 
 try:
@@ -18,9 +26,48 @@ except ImportError:
         PY3 = False
 
 if six.PY3:
+    import http.client as http_client
+    import queue
+    import urllib.error as urllib_error
+    import urllib.parse as urllib_parse
     import urllib.request as urllib_request
+    import xmlrpc.client as xmlrpc_client
 else:
+    import httplib as http_client
+    import Queue as queue
     import urllib2 as urllib_request
+    import urllib2 as urllib_error
+    import urlparse as urllib_parse
+    import xmlrpclib as xmlrpc_client
+
+from . import profiling
+from .version import __version__
+
+
+# itertools.izip is gone in python3, where zip is lazy anyway
+_izip = getattr(itertools, "izip", zip)
+
+
+def default_opener(version, program=sys.argv[0]):
+
+    """Create urllib(2) opener to always add user-agent header."""
+
+    user_agent = "{}/{}".format(os.path.basename(program), version)
+
+    headers = list()
+    headers.append(("User-Agent", user_agent))
+
+    # This is an intentionally undocumented hack for less intrusive testing.
+    # Use it only if you know what you are doing.
+    # http_cache_control=only-if-cached http_proxy=127.0.0.1:8123 program ...
+    if "http_cache_control" in os.environ:
+        logging.warning("more magic, anything may happen")
+        headers.append(("Cache-Control", os.environ["http_cache_control"]))
+
+    opener = urllib_request.build_opener()
+    opener.addheaders = headers
+
+    return opener
 
 
 def binary_stdout():
@@ -35,6 +82,256 @@ def binary_stdout():
         return sys.stdout
 
 
+class _PooledResponse(object):
+
+    """Response of WarmOpener, giving back its connection when done."""
+
+    def __init__(self, response, url, done):
+
+        self._response = response
+        self._url = url
+        self._done = done
+
+    def _finish(self):
+
+        if self._done is not None:
+            self._done()
+            self._done = None
+
+    def read(self, *args):
+
+        data = self._response.read(*args)
+        if self._response.isclosed():
+            self._finish()
+        return data
+
+    def close(self):
+
+        self._finish()
+        self._response.close()
+
+    def getcode(self):
+
+        return self._response.status
+
+    def info(self):
+
+        return self._response.msg
+
+    def geturl(self):
+
+        return self._url
+
+    def __getattr__(self, attr):
+
+        return getattr(self.__dict__["_response"], attr)
+
+
+class WarmOpener(object):
+
+    """
+    Opener keeping its HTTP connections warm.
+
+    May be used in place of urllib(2) openers here. Connections are kept
+    alive and reused, and may be set up (DNS resolution, TCP handshake)
+    in the background by warm() - e.g. while a video is being hashed.
+
+    Only GET requests of http:// URL strings are handled this way.
+    Anything else (Request objects, https, proxies) is passed on to the
+    fallback opener.
+    """
+
+    _redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, fallback=urllib_request.build_opener(),
+                 max_redirects=5):
+
+        """
+        Takes:
+            fallback - urllib(2) opener object, its addheaders are
+                used for all requests
+            max_redirects - follow this many redirects at most
+        """
+
+        self.fallback = fallback
+        self.max_redirects = max_redirects
+
+        self._proxied = "http" in urllib_request.getproxies()
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)  # netloc: [conn, ...]
+        self._warming = dict()  # netloc: (thread, conn)
+
+    @property
+    def addheaders(self):
+
+        return self.fallback.addheaders
+
+    def warm(self, netloc):
+
+        """
+        Start connecting to a server in the background, unless there's
+        a connection to it already.
+
+        Takes:
+            netloc - host[:port] of server
+        """
+
+        if self._proxied:
+            return
+
+        with self._lock:
+            if netloc in self._warming or self._idle[netloc]:
+                return
+
+            conn = http_client.HTTPConnection(netloc)
+
+            def connect():
+                try:
+                    conn.connect()
+                except (http_client.HTTPException, socket.error) as e:
+                    # The request will connect again and report errors.
+                    logging.debug("warming {} failed: {}".format(netloc, e))
+
+            thread = threading.Thread(target=connect)
+            thread.daemon = True
+            self._warming[netloc] = (thread, conn)
+            thread.start()
+
+        logging.debug("warming connection to: {}".format(netloc))
+
+    def _acquire(self, netloc):
+
+        """Returns: (connection, whether it was used before)"""
+
+        with self._lock:
+            warming = self._warming.pop(netloc, None)
+            if warming is None and self._idle[netloc]:
+                return self._idle[netloc].pop(), True
+
+        if warming is not None:
+            thread, conn = warming
+            thread.join()
+            return conn, False
+
+        return http_client.HTTPConnection(netloc), False
+
+    def _release(self, netloc, conn, response):
+
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            with self._lock:
+                self._idle[netloc].append(conn)
+
+    def open(self, url, _redirects=0):
+
+        """Open url, like urllib(2) openers do."""
+
+        if isinstance(url, urllib_request.Request) or self._proxied:
+            return self.fallback.open(url)
+
+        parts = urllib_parse.urlsplit(url)
+        if parts.scheme != "http":
+            return self.fallback.open(url)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            conn, reused = self._acquire(parts.netloc)
+            try:
+                conn.request("GET", path, headers=dict(self.addheaders))
+                response = conn.getresponse()
+            except (http_client.HTTPException, socket.error) as e:
+                conn.close()
+                if reused:
+                    # The server closed the idle connection meanwhile.
+                    continue
+                raise urllib_error.URLError(e)
+            break
+
+        if (response.status in self._redirect_codes
+                and _redirects < self.max_redirects):
+
+            location = response.getheader("Location")
+            response.read()
+            self._release(parts.netloc, conn, response)
+            return self.open(
+                urllib_parse.urljoin(url, location), _redirects + 1)
+
+        if response.status >= 400:
+            body = response.read()
+            self._release(parts.netloc, conn, response)
+            raise urllib_error.HTTPError(
+                url, response.status, response.reason, response.msg,
+                io.BytesIO(body))
+
+        return _PooledResponse(
+            response,
+            url,
+            lambda: self._release(parts.netloc, conn, response),
+            )
+
+
+def binary_stdin():
+
+    """Binary stdin: yields bytes, not strings."""
+
+    if six.PY3:
+        return sys.stdin.buffer
+    else:
+        return sys.stdin
+
+
+def iter_paths(file_, null=False):
+
+    """
+    Read paths lazily, e.g. from stdin fed by find(1).
+
+    Takes:
+        file_ - binary file-like object
+        null - paths are separated by NUL (find -print0), not newline
+
+    Yields:
+        paths as soon as they are read, empty ones skipped
+    """
+
+    if null:
+        read = getattr(file_, "read1", file_.read)
+        rest = b""
+        while True:
+            buf = read(64 * 1024)
+            if not buf:
+                break
+            parts = (rest + buf).split(b"\0")
+            rest = parts.pop()
+            for part in parts:
+                if part:
+                    yield _decode_path(part)
+        if rest:
+            yield _decode_path(rest)
+
+    else:
+        for line in iter(file_.readline, b""):
+            line = line.rstrip(b"\n")
+            if line:
+                yield _decode_path(line)
+
+
+def _decode_path(path):
+
+    return os.fsdecode(path) if six.PY3 else path
+
+
+def write_json_record(file_, record):
+
+    """Write record as one line of JSON and flush it right away."""
+
+    file_.write(json.dumps(record, sort_keys=True) + "\n")
+    file_.flush()
+
+
 def safe_open(path, overwrite=False):
 
     """
@@ -44,132 +341,692 @@ def safe_open(path, overwrite=False):
         path - path to open
         overwrite - allow/disallow to overwrite existing files (boolean)
 
-    Special case:
-        path='-': Return stdout without opening it.
+    Special case:
+        path='-': Return stdout without opening it.
+
+    """
+
+    if path == "-":
+        return binary_stdout()
+
+    if overwrite:
+        return open(path, "wb")
+
+    else:
+        # Open the file only if the open actually creates it,
+        # that is do not overwrite an existing file.
+
+        # http://docs.python.org/2/library/os.html#open-flag-constants
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        return os.fdopen(fd, "wb")
+
+
+def safe_close(file_):
+
+    """Close anything, but stdout."""
+
+    if file_ != binary_stdout():
+        file_.close()
+
+
+class NamedFile(object):
+
+    """File-like object with a name attribute."""
+
+    def __init__(self, file_, name):
+
+        self.file_ = file_
+        self.name = name
+
+    def __getattr__(self, attr):
+
+        """
+        Delegate attribute lookups to the underlying file in the same manner
+        as tempfile.NamedTemporaryFile does, but without attribute caching.
+        """
+
+        return getattr(self.__dict__["file_"], attr)
+
+
+_HASH_CHUNK_SIZE = 64 * 1024  # bytes
+_HASH_FMT = "q"  # long long
+
+
+def _sum_chunk(hash_, buf):
+
+    """Add the 64 bit integers packed into buf to hash_ (modulo 2**64)."""
+
+    count = len(buf) // struct.calcsize(_HASH_FMT)
+    hash_ += sum(struct.unpack("{}{}".format(count, _HASH_FMT), buf))
+    return hash_ & 0xFFFFFFFFFFFFFFFF  # to remain as 64 bit number
+
+
+def _check_hash_size(file_size):
+
+    if file_size < 2 * _HASH_CHUNK_SIZE:
+        raise Exception(
+            "file too small: < {} bytes".format(2 * _HASH_CHUNK_SIZE))
+
+
+@profiling.profiled
+def hash_file(file_, file_size=None):
+
+    """
+    Hash an open file.
+
+    The hash algorithm and some of the code comes from:
+    http://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes
+
+    A multi-file movie's hash is the hash of the first file.
+
+    Takes:
+        file - seekable file-like object
+        file_size - size of file in bytes
+
+    Returns:
+        hash as a zero-padded, 16-digit, lower case hex string
+
+    Raises:
+        Exception - file too small: < 128 KiB
+    """
+
+    assert _HASH_CHUNK_SIZE % struct.calcsize(_HASH_FMT) == 0
+
+    def chunk(hash_, seek_args):
+        file_.seek(*seek_args)
+        buf = file_.read(_HASH_CHUNK_SIZE)
+        if len(buf) != _HASH_CHUNK_SIZE:
+            raise Exception("short read while hashing")
+        return _sum_chunk(hash_, buf)
+
+    saved_pos = file_.tell()
+    try:
+        if file_size is None:
+            file_.seek(0, os.SEEK_END)
+            file_size = file_.tell()
+
+        _check_hash_size(file_size)
+
+        hash_ = file_size
+        hash_ = chunk(hash_, seek_args=(0, os.SEEK_SET))
+        hash_ = chunk(hash_, seek_args=(-_HASH_CHUNK_SIZE, os.SEEK_END))
+
+    finally:
+        file_.seek(saved_pos, os.SEEK_SET)
+
+    hex_str = "{:016x}".format(hash_)
+    logging.info("hash: {}".format(hex_str))
+    return hex_str
+
+
+def _hash_cache_key(path, stat):
+
+    mtime_ns = getattr(stat, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1e9)
+
+    return "hash:{}:{}:{}".format(
+        os.path.abspath(path), stat.st_size, mtime_ns)
+
+
+def hash_path(path, cache=None):
+
+    """
+    Hash a local file by its path, looked up in cache first.
+
+    Takes:
+        path - path of file
+        cache - cache object (see opensub/cache.py), None for no caching
+
+    Returns:
+        (hash, size) where hash is like hash_file() returns it
+    """
+
+    with open(path, "rb") as file_:
+        stat = os.fstat(file_.fileno())
+        key = _hash_cache_key(path, stat)
+
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached.decode("ascii"), stat.st_size
+
+        hash_ = hash_file(file_, file_size=stat.st_size)
+
+    if cache is not None:
+        cache.set(key, hash_.encode("ascii"))
+
+    return hash_, stat.st_size
+
+
+def hash_parts(movie, cache=None):
+
+    """
+    Start hashing all parts (video files) of a movie concurrently.
+
+    Takes:
+        movie - list of video file paths
+        cache - pass down to hash_path
+
+    Returns:
+        list of AsyncResult objects, one per part: get() waits for
+        (hash, size) of the part, or raises what hash_path raised
+    """
+
+    pool = multiprocessing.pool.ThreadPool(len(movie))
+    results = [pool.apply_async(hash_path, (path,), {"cache": cache})
+               for path in movie]
+    pool.close()
+    return results
+
+
+class StreamHasher(object):
+
+    """
+    Hash data incrementally, as it streams by.
+
+    Gives the same hash as hash_file(), but needs neither a seekable file
+    nor the file size in advance. Only the first 64 KiB and (in a ring
+    buffer) the last 64 KiB of the data seen so far are kept in memory.
+
+    Usage:
+        hasher = StreamHasher()
+        for buf in ...:
+            hasher.update(buf)
+        hex_str = hasher.hexdigest()
+    """
+
+    def __init__(self):
+
+        self.size = 0
+        self._head = bytearray()
+        self._tail = bytearray(_HASH_CHUNK_SIZE)
+        self._tail_pos = 0  # oldest byte of the ring buffer, once full
+
+    def update(self, data):
+
+        """
+        Takes:
+            data - the next bytes of the stream
+        """
+
+        length = len(data)
+
+        missing = _HASH_CHUNK_SIZE - len(self._head)
+        if missing > 0:
+            self._head += data[:missing]
+
+        if length >= _HASH_CHUNK_SIZE:
+            self._tail[:] = data[length - _HASH_CHUNK_SIZE:]
+            self._tail_pos = 0
+        else:
+            end = self._tail_pos + length
+            if end <= _HASH_CHUNK_SIZE:
+                self._tail[self._tail_pos:end] = data
+            else:
+                split = _HASH_CHUNK_SIZE - self._tail_pos
+                self._tail[self._tail_pos:] = data[:split]
+                self._tail[:length - split] = data[split:]
+            self._tail_pos = end % _HASH_CHUNK_SIZE
+
+        self.size += length
+
+    def hexdigest(self):
+
+        """
+        Returns:
+            hash of the data seen so far, formatted as by hash_file()
+
+        Raises:
+            Exception - stream too small: < 128 KiB
+        """
+
+        _check_hash_size(self.size)
+
+        tail = self._tail[self._tail_pos:] + self._tail[:self._tail_pos]
+
+        hash_ = self.size
+        hash_ = _sum_chunk(hash_, bytes(self._head))
+        hash_ = _sum_chunk(hash_, bytes(tail))
+
+        return "{:016x}".format(hash_)
+
+
+def hash_stream(file_, buf_size=_HASH_CHUNK_SIZE):
+
+    """
+    Hash a file read sequentially till its end.
+
+    Takes:
+        file - readable file-like object, e.g. a pipe
+        buf_size - bytes to read at once
+
+    Returns:
+        hash as hash_file() does
+
+    Raises:
+        Exception - stream too small: < 128 KiB
+    """
+
+    hasher = StreamHasher()
+    while True:
+        buf = file_.read(buf_size)
+        if not buf:
+            break
+        hasher.update(buf)
+
+    hex_str = hasher.hexdigest()
+    logging.info("hash: {}".format(hex_str))
+    return hex_str
+
+
+def _http_request(opener, url, method=None, headers=()):
+
+    """Open url via opener, optionally overriding method and headers."""
+
+    request = urllib_request.Request(url, headers=dict(headers))
+    if method is not None:
+        request.get_method = lambda: method
+    return opener.open(request)
+
+
+def _read_range(opener, url, start, length):
+
+    """Read length bytes of url from offset start via a Range request."""
+
+    response = _http_request(
+        opener,
+        url,
+        headers=[("Range", "bytes={}-{}".format(start, start + length - 1))],
+        )
+    try:
+        if response.getcode() != 206:
+            raise Exception("range request not honoured: {}".format(url))
+        buf = response.read(length)
+    finally:
+        response.close()
+
+    if len(buf) != length:
+        raise Exception("short read while hashing: {}".format(url))
+    return buf
+
+
+def hash_url(url, opener=urllib_request.build_opener()):
+
+    """
+    Hash a remote file without downloading all of it.
+
+    Takes the size from a HEAD request, then fetches exactly the first
+    and last 64 KiB via Range requests.
+
+    Takes:
+        url - http(s) URL of the video file
+        opener - urllib(2) opener object
+
+    Returns:
+        hash as hash_file() does
+
+    Raises:
+        Exception - file too small: < 128 KiB
+        Exception - server does not honour Range requests
+    """
+
+    response = _http_request(opener, url, method="HEAD")
+    try:
+        content_length = response.info().get("Content-Length")
+    finally:
+        response.close()
+
+    if content_length is None:
+        raise Exception("unknown size: {}".format(url))
+    file_size = int(content_length)
+
+    _check_hash_size(file_size)
+
+    hash_ = file_size
+    hash_ = _sum_chunk(
+        hash_, _read_range(opener, url, 0, _HASH_CHUNK_SIZE))
+    hash_ = _sum_chunk(
+        hash_,
+        _read_range(
+            opener, url, file_size - _HASH_CHUNK_SIZE, _HASH_CHUNK_SIZE))
+
+    hex_str = "{:016x}".format(hash_)
+    logging.info("hash: {}".format(hex_str))
+    return hex_str
+
+
+def hash_urls(urls, opener=urllib_request.build_opener(), jobs=8):
+
+    """
+    Hash many remote files concurrently.
+
+    Takes:
+        urls - iterable of http(s) URLs
+        opener - urllib(2) opener object
+        jobs - number of URLs hashed at the same time
+
+    Yields:
+        (url, hash, error) tuples in the order of urls,
+        either hash or error (the exception raised) is None
+    """
+
+    def hash_one(url):
+        try:
+            return url, hash_url(url, opener=opener), None
+        except Exception as e:
+            return url, None, e
+
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        for result in pool.imap(hash_one, urls):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def _to_int(text):
+
+    return None if not text else int(float(text))
+
+
+def _to_float(text):
+
+    return None if not text else float(text)
+
+
+class SearchResult(object):
+
+    """
+    A subtitle archive found by search.
+
+    The url is known right away, the rest of the fields are parsed from
+    the search response only when accessed, None if not given.
+    """
+
+    __slots__ = ("url", "_source")
+
+    # field name: (name in simplexml, name in xml-rpc, conversion)
+    _fields = {
+        "cd_count": ("cds", "SubSumCD", _to_int),
+        "format": ("format", "SubFormat", None),
+        "rating": ("subrating", "SubRating", _to_float),
+        "downloads": ("downloads", "SubDownloadsCnt", _to_int),
+        "subtitle_id": ("idsubtitle", "IDSubtitle", None),
+        }
+
+    def __init__(self, url, source):
+
+        """
+        Takes:
+            url - subtitle archive url
+            source - <subtitle> element of the simplexml search page or
+                row (dict) of the xml-rpc search response
+        """
+
+        self.url = url
+        self._source = source
+
+    def _field(self, name):
+
+        simplexml_name, xmlrpc_name, convert = self._fields[name]
+
+        if isinstance(self._source, dict):
+            text = self._source.get(xmlrpc_name)
+        else:
+            text = self._source.findtext(simplexml_name)
+
+        if text is None or convert is None:
+            return text
+        return convert(text)
+
+    @property
+    def cd_count(self):
+
+        return self._field("cd_count")
+
+    @property
+    def format(self):
+
+        return self._field("format")
+
+    @property
+    def rating(self):
+
+        return self._field("rating")
+
+    @property
+    def downloads(self):
+
+        return self._field("downloads")
+
+    @property
+    def subtitle_id(self):
+
+        return self._field("subtitle_id")
+
+    def __repr__(self):
+
+        return "{}({!r})".format(self.__class__, self.url)
+
+    def __str__(self):
+
+        return self.url
+
+
+RANK_KEYS = ("cds", "rating", "downloads")
+
+
+def rank_search_results(results, keys, cd_count=None):
+
+    """
+    Order search results by their metadata, best first.
+
+    Takes:
+        results - list of SearchResult objects
+        keys - list of field names to order by, in decreasing priority:
+            "cds" - results matching cd_count first
+            "rating" - higher rating first
+            "downloads" - more downloads first
+        cd_count - number of video files of the movie
+
+    Returns:
+        new list, ties keep their original order
+
+    Raises:
+        Exception - invalid key
+    """
+
+    for name in keys:
+        if name not in RANK_KEYS:
+            raise Exception("invalid rank key: {}".format(name))
+
+    def key(result):
+        sort_key = list()
+        for name in keys:
+            if name == "cds":
+                sort_key.append(result.cd_count != cd_count)
+            else:
+                value = getattr(result, name)
+                sort_key.append(-(value if value is not None else -1))
+        return sort_key
+
+    return sorted(results, key=key)
+
+
+class _SearchPageParser(object):
 
-    """
+    """Parse a simplexml search page incrementally, as it arrives."""
 
-    if path == "-":
-        return binary_stdout()
+    def __init__(self):
 
-    if overwrite:
-        return open(path, "wb")
+        self._parser = etree.XMLParser()
 
-    else:
-        # Open the file only if the open actually creates it,
-        # that is do not overwrite an existing file.
+    def feed(self, data):
 
-        # http://docs.python.org/2/library/os.html#open-flag-constants
-        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
-        return os.fdopen(fd, "wb")
+        self._parser.feed(data)
 
+    def close(self):
 
-def safe_close(file_):
+        """
+        Returns:
+            list of SearchResult objects (ordered as in the search results)
+        """
 
-    """Close anything, but stdout."""
+        # future FIXME use absolute xpath: /search/results/subtitle/download
+        #
+        # findall with an absolute xpath is broken in
+        # xml.etree.Elementree 1.3.0 . I couldn't find the issue on
+        # bugs.python.org, but here is the code issuing the warning:
+        # /usr/lib/python2.7/xml/etree/ElementTree.py:745
 
-    if file_ != binary_stdout():
-        file_.close()
+        root = self._parser.close()
+        return [SearchResult(elem.findtext("download"), elem) for elem in
+            root.findall("./results/subtitle") if elem.find("download")
+            is not None]
 
 
-class NamedFile(object):
+class PartMismatch(Exception):
 
-    """File-like object with a name attribute."""
+    """Subtitles of an archive don't pair up with the parts of a movie."""
 
-    def __init__(self, file_, name):
 
-        self.file_ = file_
-        self.name = name
+class _XmlRpcStatusError(Exception):
 
-    def __getattr__(self, attr):
+    """Non-200 status in an xml-rpc response."""
 
-        """
-        Delegate attribute lookups to the underlying file in the same manner
-        as tempfile.NamedTemporaryFile does, but without attribute caching.
-        """
 
-        return getattr(self.__dict__["file_"], attr)
+# Failures of an xml-rpc request worth falling back from: network,
+# protocol and malformed responses (missing fields, bad hashes).
+_XMLRPC_ERRORS = (
+    urllib_error.URLError,
+    http_client.HTTPException,
+    socket.error,
+    xml.parsers.expat.ExpatError,
+    xmlrpc_client.Error,
+    _XmlRpcStatusError,
+    KeyError,
+    ValueError,
+    )
 
 
-def hash_file(file_, file_size=None):
+class ServerHealth(object):
 
-    """
-    Hash an open file.
+    """Response times and failures of a server, as seen by UserAgent."""
 
-    The hash algorithm and some of the code comes from:
-    http://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes
+    def __init__(self, default_delay=1.0, samples=100):
 
-    A multi-file movie's hash is the hash of the first file.
+        """
+        Takes:
+            default_delay - p95() until there are enough samples (seconds)
+            samples - number of recent response times to keep
+        """
 
-    Takes:
-        file - seekable file-like object
-        file_size - size of file in bytes
+        self.default_delay = default_delay
+        self.response_times = collections.deque(maxlen=samples)
+        self.consecutive_failures = 0
 
-    Returns:
-        hash as a zero-padded, 16-digit, lower case hex string
+    def succeeded(self, response_time):
 
-    Raises:
-        Exception - file too small: < 128 KiB
-    """
+        self.response_times.append(response_time)
+        self.consecutive_failures = 0
 
-    fmt = "q"  # long long
-    buf_size = struct.calcsize(fmt)
-    chunk_size = 64 * 1024  # bytes
+    def failed(self):
 
-    assert chunk_size % buf_size == 0
+        self.consecutive_failures += 1
 
-    def chunk(hash_, seek_args):
-        file_.seek(*seek_args)
-        for _ in range(chunk_size // buf_size):
-            buf = file_.read(buf_size)
-            hash_ += struct.unpack(fmt, buf)[0]
-            hash_ &= 0xFFFFFFFFFFFFFFFF  # to remain as 64 bit number
-        return hash_
+    def p95(self):
 
-    saved_pos = file_.tell()
-    try:
-        if file_size is None:
-            file_.seek(0, os.SEEK_END)
-            file_size = file_.tell()
+        """Returns: 95th percentile of recent response times (seconds)."""
 
-        if file_size < 2 * chunk_size:
-            raise Exception(
-                "file too small: < {} bytes".format(2 * chunk_size))
+        if len(self.response_times) < 10:
+            return self.default_delay
+        times = sorted(self.response_times)
+        return times[int(0.95 * (len(times) - 1))]
 
-        hash_ = file_size
-        hash_ = chunk(hash_, seek_args=(0, os.SEEK_SET))
-        hash_ = chunk(hash_, seek_args=(-chunk_size, os.SEEK_END))
+    def rank(self):
 
-    finally:
-        file_.seek(saved_pos, os.SEEK_SET)
+        """Returns: sort key, lower is healthier."""
 
-    hex_str = "{:016x}".format(hash_)
-    logging.info("hash: {}".format(hex_str))
-    return hex_str
+        return self.consecutive_failures
+
+    def __repr__(self):
+
+        return "{}({!r})".format(self.__class__, self.__dict__)
 
 
 class UserAgent(object):
 
     """Communicate with subtitle servers."""
 
-    def __init__(self, server, opener=urllib_request.build_opener()):
+    # Not registered at opensubtitles.org, see xmlrpc_user_agent below.
+    xmlrpc_user_agent = "opensub-utils v{}".format(__version__)
+
+    def __init__(
+        self,
+        server,
+        opener=urllib_request.build_opener(),
+        mirrors=(),
+        hedge_delay=None,
+        cache=None,
+        xmlrpc_url=None,
+        xmlrpc_user_agent=None,
+        search_ttl=24 * 60 * 60,
+        ):
 
         """
         Takes:
             server - FQDN or IP of server
                 e.g. "www.opensubtitles.org"
             opener - urllib(2) opener object
+            mirrors - FQDN or IP of mirrors of server, in preference order
+                Searches not answered by a server in time are repeated
+                (hedged) on the next one. See _fetch_search_page().
+            hedge_delay - seconds to wait for a server before hedging,
+                None to use the 95th percentile of its response times
+            cache - cache object for hashes and search pages
+                (see opensub/cache.py), None for no caching
+            xmlrpc_url - url of the xml-rpc interface,
+                default: http://<server>/xml-rpc
+            xmlrpc_user_agent - user agent to log in to xml-rpc with
+                opensubtitles.org accepts registered user agents only,
+                see: http://trac.opensubtitles.org/projects/opensubtitles
+                    /wiki/DevReadFirst
+            search_ttl - seconds to take search pages from the cache,
+                None for no expiry
         """
 
         self.server = server
         self.opener = opener
+        self.mirrors = list(mirrors)
+        self.hedge_delay = hedge_delay
+        self.cache = cache
+        self.xmlrpc_url = xmlrpc_url
+        if xmlrpc_user_agent is not None:
+            self.xmlrpc_user_agent = xmlrpc_user_agent
+        self.search_ttl = search_ttl
+
+        self.health = dict(
+            (server_, ServerHealth()) for server_ in [server] + self.mirrors)
+
+        self._token = None
+        self._multi_search = True
+
+    def servers(self):
+
+        """Returns: server and its mirrors, healthiest first."""
+
+        return sorted(
+            [self.server] + self.mirrors,
+            key=lambda server: self.health[server].rank())
 
     # FIXME Which variant of ISO 639 is accepted?
     #
     # So far I have used the 3-letter codes like 'eng', 'hun'...
 
     def _search_page_url(
-        self, movie_hash, language, cd_count=1, _fmt="simplexml"):
+        self, movie_hash, language, cd_count=1, _fmt="simplexml",
+        server=None):
 
         """
         Construct search page URL.
@@ -179,13 +1036,14 @@ class UserAgent(object):
                 cf. movie_hash()
             language - preferred language (ISO 639 code string)
             cd_count - how many video files make up the movie?
+            server - server to search on, default: self.server
 
         Returns:
             search page URL
         """
 
         url = ("http://"
-            + self.server
+            + (server or self.server)
             + "/en"
             + "/search"
             + "/sublanguageid-{}".format(language)
@@ -196,44 +1054,381 @@ class UserAgent(object):
         logging.debug("search_page_url: {}".format(url))
         return url
 
-    def search(self, movie, language):
+    def _hash_movie(self, movie):
+
+        """Returns: movie hash, i.e. the hash of the first video file."""
+
+        return hash_path(movie[0], cache=self.cache)[0]
+
+    def _fetch_search_page(self, server, url_kwargs, cancelled):
+
+        """Returns: search page from server, None if cancelled meanwhile."""
+
+        started = time.time()
+        try:
+            search_page_xml = self.opener.open(
+                self._search_page_url(server=server, **url_kwargs))
+        except Exception:
+            self.health[server].failed()
+            raise
+
+        self.health[server].succeeded(time.time() - started)
+
+        try:
+            if cancelled.is_set():
+                return None
+            return search_page_xml.read()
+        finally:
+            search_page_xml.close()
+
+    def _hedged_fetch_search_page(self, **url_kwargs):
 
         """
-        Takes:
-            movie - list of video file paths in "natural order"
-            language - ISO 639 code of subtitle language
+        Fetch the search page from the healthiest server. If it does not
+        answer within the hedge delay (or fails), repeat the request on
+        the next server too. Take whichever answers first.
+
+        The others are cancelled: their responses are closed unread as
+        soon as they arrive, because urllib can't interrupt a request
+        in progress.
 
         Returns:
-            list of subtitle archive URLs (ordered as in the search results)
+            search page (bytes)
         """
 
-        with open(movie[0], "rb") as file_:
-            movie_hash = hash_file(file_)
+        servers = self.servers()
+        answers = queue.Queue()
+        cancelled = threading.Event()
+
+        def attempt(server):
+            try:
+                page = self._fetch_search_page(server, url_kwargs, cancelled)
+                answers.put((page, None))
+            except Exception as e:
+                answers.put((None, e))
+
+        def launch(server):
+            thread = threading.Thread(target=attempt, args=(server,))
+            thread.daemon = True
+            thread.start()
+
+        launch(servers[0])
+        launched = 1
+        failures = 0
+
+        while True:
+
+            delay = None
+            if launched < len(servers):
+                delay = self.hedge_delay
+                if delay is None:
+                    delay = self.health[servers[launched - 1]].p95()
+
+            try:
+                page, error = answers.get(timeout=delay)
+            except queue.Empty:
+                logging.info("hedging search on: {}".format(
+                    servers[launched]))
+                launch(servers[launched])
+                launched += 1
+                continue
+
+            if error is None:
+                cancelled.set()
+                return page
+
+            logging.warning("search failed: {}".format(error))
+            failures += 1
+            if failures == len(servers):
+                raise error
+            if launched < len(servers):
+                launch(servers[launched])
+                launched += 1
+
+    def _search_cache_key(self, movie_hash, language, cd_count):
+
+        return "search:{}:{}:{}".format(language, movie_hash, cd_count)
+
+    def _load_search_page(self, key):
+
+        """Returns: search page cached for key, None if missing/expired."""
+
+        if self.cache is None:
+            return None
+
+        value = self.cache.get(key)
+        if value is None:
+            return None
+
+        # <unix time of caching>\n<page>
+        stamp, _, page = value.partition(b"\n")
+        try:
+            age = time.time() - float(stamp)
+        except ValueError:
+            return None  # cached without a time by an older version
+        if self.search_ttl is not None and age > self.search_ttl:
+            return None
 
-        cd_count = len(movie)
+        return page
 
-        search_page_url = self._search_page_url(
+    def _save_search_page(self, key, page):
+
+        if self.cache is not None:
+            stamp = "{:.0f}\n".format(time.time()).encode("ascii")
+            self.cache.set(key, stamp + page)
+
+    def _search_by_hash(self, movie_hash, cd_count, language):
+
+        url_kwargs = dict(
             language=language,
             movie_hash=movie_hash,
             cd_count=cd_count,
             )
 
-        # future FIXME use absolute xpath: /search/results/subtitle/download
-        #
-        # findall with an absolute xpath is broken in
-        # xml.etree.Elementree 1.3.0 . I couldn't find the issue on
-        # bugs.python.org, but here is the code issuing the warning:
-        # /usr/lib/python2.7/xml/etree/ElementTree.py:745
+        key = self._search_cache_key(**url_kwargs)
+        page = self._load_search_page(key)
+        cached = page is not None
+
+        if cached:
+            logging.debug("search page from cache: {}".format(key))
+        elif self.mirrors:
+            page = self._hedged_fetch_search_page(**url_kwargs)
+        else:
+            search_page_xml = self.opener.open(
+                self._search_page_url(**url_kwargs))
+            page = search_page_xml.read()
+            search_page_xml.close()
+
+        parser = _SearchPageParser()
+        parser.feed(page)
+        results = parser.close()
+
+        # Not found may be found later, when someone uploads subtitles.
+        if results and not cached:
+            self._save_search_page(key, page)
+
+        return results
+
+    @profiling.profiled
+    def search(self, movie, language, movie_hash=None):
+
+        """
+        Takes:
+            movie - list of video file paths in "natural order"
+            language - ISO 639 code of subtitle language
+            movie_hash - hash of movie, if already known
+
+        Returns:
+            list of SearchResult objects (ordered as in the search results)
+        """
+
+        if movie_hash is None:
+            movie_hash = self._hash_movie(movie)
+
+        return self._search_by_hash(
+            movie_hash=movie_hash,
+            cd_count=len(movie),
+            language=language,
+            )
+
+    # The xml-rpc interface is used only for what the simplexml one cannot
+    # do: search for many movies in one request. It needs a login, but
+    # anonymous login is accepted.
+    #
+    # http://trac.opensubtitles.org/projects/opensubtitles/wiki/XMLRPC
+
+    def _xmlrpc_call(self, method, *params):
+
+        url = self.xmlrpc_url or "http://" + self.server + "/xml-rpc"
+        request = urllib_request.Request(
+            url,
+            data=xmlrpc_client.dumps(params, method).encode("utf-8"),
+            headers={"Content-Type": "text/xml"},
+            )
+
+        response = self.opener.open(request)
+        try:
+            result = xmlrpc_client.loads(response.read())[0][0]
+        finally:
+            response.close()
+
+        status = result.get("status", "")
+        if not status.startswith("200"):
+            raise _XmlRpcStatusError("{}: {}".format(method, status))
+        return result
+
+    def _xmlrpc_token(self):
+
+        if self._token is None:
+            self._token = self._xmlrpc_call(
+                "LogIn", "", "", "en", self.xmlrpc_user_agent)["token"]
+        return self._token
+
+    def _search_batch(self, batch, language):
+
+        """
+        Takes:
+            batch - list of (movie hash, file size, cd count) tuples
+
+        Returns:
+            list of search results for each movie of batch
+        """
+
+        queries = [
+            {
+                "moviehash": movie_hash,
+                "moviebytesize": str(file_size),
+                "sublanguageid": language,
+            }
+            for movie_hash, file_size, _ in batch]
+
+        data = self._xmlrpc_call(
+            "SearchSubtitles", self._xmlrpc_token(), queries)["data"]
+
+        # There is a row per subtitle file, that is multiple rows for
+        # multi-cd subtitles, all with the same archive.
+        results_by_movie = dict()
+        for row in data or []:
+            key = (int(row["MovieHash"], 16), int(row["SubSumCD"]))
+            results = results_by_movie.setdefault(key, [])
+            url = row["ZipDownloadLink"]
+            if url not in [result.url for result in results]:
+                results.append(SearchResult(url, row))
+
+        return [results_by_movie.get((int(movie_hash, 16), cd_count), [])
+                for movie_hash, _, cd_count in batch]
+
+    def _search_one_by_one(self, batch, language):
+
+        """Returns: (search results, error) for each movie of batch."""
+
+        outcomes = list()
+        for movie_hash, _, cd_count in batch:
+            try:
+                outcomes.append((self._search_by_hash(
+                    movie_hash=movie_hash,
+                    cd_count=cd_count,
+                    language=language,
+                    ), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    def search_many(self, movies, language, batch_size=100):
+
+        """
+        Search for many movies in as few server requests as possible.
+
+        Batches the server can't answer via xml-rpc are searched movie by
+        movie. If the very first batch fails, xml-rpc is not tried again.
+
+        Takes:
+            movies - list of movies, each a list of video file paths
+            language - ISO 639 code of subtitle language
+            batch_size - number of movies searched in one request
+
+        Returns:
+            list of (search results, error) for each movie, either is None
+            search results are as returned by search(),
+            error is the exception raised for the movie (e.g. on hashing)
+        """
+
+        outcomes = [None] * len(movies)
+        queued = list()  # (index of movie, (movie hash, size, cd count))
+
+        for idx, movie in enumerate(movies):
+            try:
+                queued.append((idx, (
+                    self._hash_movie(movie),
+                    os.path.getsize(movie[0]),
+                    len(movie),
+                    )))
+            except Exception as e:
+                outcomes[idx] = (None, e)
+
+        answered = False
+        for start in range(0, len(queued), batch_size):
+            indexes = [idx for idx, _ in queued[start:start + batch_size]]
+            batch = [query for _, query in queued[start:start + batch_size]]
+
+            batch_outcomes = None
+            if self._multi_search:
+                try:
+                    batch_outcomes = [
+                        (results, None)
+                        for results in self._search_batch(batch, language)]
+                    answered = True
+                except _XMLRPC_ERRORS as e:
+                    logging.warning(
+                        "multi-movie search failed: {}".format(e))
+                    if not answered:
+                        self._multi_search = False
+
+            if batch_outcomes is None:
+                batch_outcomes = self._search_one_by_one(batch, language)
+
+            for idx, outcome in zip(indexes, batch_outcomes):
+                outcomes[idx] = outcome
+
+        return outcomes
+
+    def part_names(self, parts, language, subtitle_id):
+
+        """
+        Look up which subtitle file of an archive belongs to which part
+        of a multi-cd movie, by the hashes of the parts.
+
+        Needs xml-rpc, the simplexml search page has no per-part data.
+
+        Takes:
+            parts - list of (hash, size) for each part of the movie
+            language - ISO 639 code of subtitle language
+            subtitle_id - SearchResult.subtitle_id of the archive
+
+        Returns:
+            list of subtitle file names (as named in the archive) for each
+            part, None for parts the server doesn't know the subtitle for,
+            or None if the server can't tell (e.g. has no xml-rpc)
+
+        Raises:
+            PartMismatch - the subtitle is for another file of some part
+        """
+
+        if subtitle_id is None:
+            return None
+
+        queries = [
+            {
+                "moviehash": part_hash,
+                "moviebytesize": str(part_size),
+                "sublanguageid": language,
+            }
+            for part_hash, part_size in parts]
 
-        search_page_xml = self.opener.open(search_page_url)
+        try:
+            data = self._xmlrpc_call(
+                "SearchSubtitles", self._xmlrpc_token(), queries)["data"]
 
-        tree = etree.parse(search_page_xml)
-        search_results = [elem.text for elem in
-            tree.findall("./results/subtitle/download")]
+            names_by_hash = dict()
+            for row in data or []:
+                if str(row["IDSubtitle"]) == str(subtitle_id):
+                    row_hash = int(row["MovieHash"], 16)
+                    names_by_hash[row_hash] = row["SubFileName"]
+        except _XMLRPC_ERRORS as e:
+            logging.warning("can't look up parts: {}".format(e))
+            return None
 
-        search_page_xml.close()
+        names = [names_by_hash.get(int(part_hash, 16))
+                 for part_hash, _ in parts]
 
-        return search_results
+        if None in names and any(name is not None for name in names):
+            raise PartMismatch(
+                "subtitle {} is not for part(s): {}".format(
+                    subtitle_id,
+                    ", ".join(str(num) for num, name in enumerate(names, 1)
+                              if name is None)))
+
+        return names
 
     def __repr__(self):
 
@@ -244,6 +1439,76 @@ class UserAgent(object):
         return "{}({!r})".format(self.__class__, self.server)
 
 
+class ArchiveLimitExceeded(Exception):
+
+    """A subtitle archive is larger than SubtitleArchive was allowed."""
+
+
+_BOUNDED_READ_SIZE = 64 * 1024  # bytes
+
+
+class _BoundedFile(NamedFile):
+
+    """NamedFile raising ArchiveLimitExceeded past max_size bytes read."""
+
+    def __init__(self, file_, name, max_size):
+
+        NamedFile.__init__(self, file_, name)
+        self.max_size = max_size
+        self.size = 0
+
+    def _limit(self, size):
+
+        """Returns: bytes to read at most, one past the cap to detect it."""
+
+        limit = self.max_size - self.size + 1
+        if size is None or size < 0:
+            return limit
+        return min(size, limit)
+
+    def _count(self, buf):
+
+        self.size += len(buf)
+        if self.size > self.max_size:
+            raise ArchiveLimitExceeded(
+                "archive member is larger than {} bytes: {}".format(
+                    self.max_size, self.name))
+        return buf
+
+    def read(self, size=-1):
+
+        if size is not None and size >= 0:
+            return self._count(self.file_.read(self._limit(size)))
+
+        # never decompress more than the cap, even if asked for everything
+        bufs = list()
+        while True:
+            buf = self._count(
+                self.file_.read(self._limit(_BOUNDED_READ_SIZE)))
+            if not buf:
+                return b"".join(bufs)
+            bufs.append(buf)
+
+    def readline(self, size=-1):
+
+        return self._count(self.file_.readline(self._limit(size)))
+
+    def readlines(self, hint=-1):
+
+        lines = list()
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if hint is not None and 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+
+        return iter(self.readline, b"")
+
+
 class SubtitleArchive(object):
 
     """
@@ -276,6 +1541,11 @@ class SubtitleArchive(object):
         sort_key=str.lower,
         extensions=set(
             [".srt", ".sub", ".smi", ".txt", ".ssa", ".ass", ".mpl"]),
+        max_archive_size=None,
+        max_members=None,
+        max_member_size=None,
+        buf_size=64 * 1024,
+        cache=None,
         ):
 
         """
@@ -289,17 +1559,35 @@ class SubtitleArchive(object):
             sort_key - determines yield order of subtitles
             extensions - iterable of valid subtitle extensions
                 lower case, include leading dot
+            max_archive_size - bytes to download at most
+            max_members - count of files (of any kind) in the archive
+            max_member_size - bytes to decompress of a subtitle at most
+            buf_size - bytes to copy at once
+            cache - cache object for the archive (see opensub/cache.py),
+                None for no caching
+
+        The limits are None for unlimited. They're checked as the archive
+        is being downloaded and decompressed, not by the sizes it claims.
+        Exceeding any raises ArchiveLimitExceeded.
         """
 
         self.url = url
         self.opener = opener
         self.sort_key = sort_key
         self.extensions = extensions
+        self.max_archive_size = max_archive_size
+        self.max_members = max_members
+        self.max_member_size = max_member_size
+        self.buf_size = buf_size
+        self.cache = cache
 
         # We may set these directly for testing purposes.
         self.tempfile = None
         self.zipfile = None
 
+        # paths written by extract()
+        self.files_written = list()
+
         logging.debug("archive_url: {}".format(self.url))
 
     def __enter__(self):
@@ -324,13 +1612,68 @@ class SubtitleArchive(object):
         # See the notes here on why we need a *Named*TemporaryFile:
         # http://docs.python.org/2/library/zipfile#zipfile.ZipFile.open
 
-        if self.tempfile is None:
+        if self.tempfile is None and not self._load_from_cache():
             dst = tempfile.NamedTemporaryFile()
-            src = self.opener.open(self.url)
-            shutil.copyfileobj(src, dst)
-            src.close()
+            try:
+                src = self.opener.open(self.url)
+                try:
+                    self._check_archive_size(
+                        _to_int(src.info().get("Content-Length")) or 0)
+                    size = 0
+                    while True:
+                        buf = src.read(self.buf_size)
+                        if not buf:
+                            break
+                        size += len(buf)
+                        self._check_archive_size(size)
+                        dst.write(buf)
+                finally:
+                    src.close()
+            except BaseException:
+                dst.close()
+                raise
             dst.seek(0, os.SEEK_SET)
             self.tempfile = dst
+            self._save_to_cache()
+
+    def _load_from_cache(self):
+
+        """Returns: True if self.tempfile was filled from the cache."""
+
+        if self.cache is None:
+            return False
+
+        archive = self.cache.get("archive:" + self.url)
+        if archive is None:
+            return False
+
+        logging.debug("archive from cache: {}".format(self.url))
+        self._check_archive_size(len(archive))
+        dst = tempfile.NamedTemporaryFile()
+        dst.write(archive)
+        dst.flush()
+        dst.seek(0, os.SEEK_SET)
+        self.tempfile = dst
+        return True
+
+    def _save_to_cache(self):
+
+        if self.cache is not None:
+            self.cache.set("archive:" + self.url, self.tempfile.read())
+            self.tempfile.seek(0, os.SEEK_SET)
+
+    def _check_archive_size(self, size):
+
+        if self.max_archive_size is not None and size > self.max_archive_size:
+            raise ArchiveLimitExceeded(
+                "archive is larger than {} bytes: {}".format(
+                    self.max_archive_size, self.url))
+
+    def download(self):
+
+        """Download the archive to a temporary file, unless already done."""
+
+        self._urlopen_via_tempfile()
 
     def _open_as_zipfile(self):
 
@@ -344,20 +1687,94 @@ class SubtitleArchive(object):
         Yields:
             subtitle_file with an extra name attribute in the order
             determined by sort_key.
+
+        Raises:
+            ArchiveLimitExceeded - as soon as a limit is exceeded,
+                maybe while a subtitle_file is being read
         """
 
+        for subtitle_file in self._yield_open_names(self._subtitle_names()):
+            yield subtitle_file
+
+    def _subtitle_names(self):
+
+        """Returns: names of subtitles in the archive, ordered by sort_key."""
+
         self._open_as_zipfile()
 
-        for name in sorted(self.zipfile.namelist(), key=self.sort_key):
+        count = len(self.zipfile.infolist())
+        if self.max_members is not None and count > self.max_members:
+            raise ArchiveLimitExceeded(
+                "archive has more than {} members: {}".format(
+                    self.max_members, self.url))
 
-            ext = os.path.splitext(name)[1]
-            if ext.lower() not in self.extensions:
-                continue
+        return [
+            name
+            for name in sorted(self.zipfile.namelist(), key=self.sort_key)
+            if os.path.splitext(name)[1].lower() in self.extensions]
 
+    def _yield_open_names(self, names):
+
+        for name in names:
             with self.zipfile.open(name) as file_:
-                yield NamedFile(file_, name)
+                if self.max_member_size is None:
+                    yield NamedFile(file_, name)
+                else:
+                    yield _BoundedFile(file_, name, self.max_member_size)
+
+    def pair(self, movie, part_names=None):
+
+        """
+        Pair the subtitles in the archive with the parts of a movie,
+        before anything is extracted.
+
+        Takes:
+            movie - list of video files in "natural order"
+            part_names - subtitle file name for each part of movie, as
+                UserAgent.part_names() returns it, None where unknown
+                Unknown parts get the rest of the subtitles in order.
 
-    def extract(self, movie, builder, overwrite=False):
+        Returns:
+            list of (video file, name of subtitle in archive) to pass to
+            extract()
+
+        Raises:
+            PartMismatch - the count of subtitles and video files differ,
+                or a named subtitle is missing from the archive
+        """
+
+        names = self._subtitle_names()
+        if len(names) != len(movie):
+            raise PartMismatch(
+                "{} subtitle file(s) for {} video file(s): {}".format(
+                    len(names), len(movie), self.url))
+
+        if part_names is None:
+            part_names = [None] * len(movie)
+
+        by_base_name = dict(
+            (name.rsplit("/", 1)[-1].lower(), name) for name in names)
+        remaining = list(names)
+        chosen = list()
+
+        for part_name in part_names:
+            name = None
+            if part_name is not None:
+                name = by_base_name.get(part_name.lower())
+                if name not in remaining:
+                    raise PartMismatch(
+                        "subtitle file missing from archive: {}".format(
+                            part_name))
+                remaining.remove(name)
+            chosen.append(name)
+
+        remaining = iter(remaining)
+        return [(video, next(remaining) if name is None else name)
+                for video, name in zip(movie, chosen)]
+
+    @profiling.profiled
+    def extract(
+        self, movie, builder, overwrite=False, store=None, pairs=None):
 
         """
         Extract subtitles from archive according to movie and naming scheme.
@@ -366,16 +1783,30 @@ class SubtitleArchive(object):
             movie - list of video files in "natural order"
             builder - FilenameBuilder() object
             overwrite - pass down to safe_open
+            store - ContentStore to write subtitles to once, and hardlink
+                them to their destinations, None to write them directly
+            pairs - video files and subtitles as pair() returns them,
+                None to pair them in "natural order" as they come
 
         Returns:
             number of subtitle files extracted and successfully written
+
+        Side effect:
+            paths written are appended to self.files_written
         """
 
         template_counter = itertools.count(1)
         count_of_files_written = 0
 
-        for template_num, video_path, subtitle_file in itertools.izip(
-            template_counter, movie, self.yield_open()):
+        if pairs is None:
+            subtitle_files = self.yield_open()
+        else:
+            movie = [video_path for video_path, _ in pairs]
+            subtitle_files = self._yield_open_names(
+                [name for _, name in pairs])
+
+        for template_num, video_path, subtitle_file in _izip(
+            template_counter, movie, subtitle_files):
 
             dst = builder.build(
                 video=video_path,
@@ -387,7 +1818,20 @@ class SubtitleArchive(object):
             logging.debug("dst: {}".format(dst))
 
             try:
-                dst_file = safe_open(dst, overwrite=overwrite)
+                if store is not None and dst != "-":
+                    store.install(subtitle_file, dst, overwrite=overwrite)
+                else:
+                    dst_file = safe_open(dst, overwrite=overwrite)
+                    try:
+                        shutil.copyfileobj(
+                            subtitle_file, dst_file, self.buf_size)
+                    except BaseException:
+                        safe_close(dst_file)
+                        if dst != "-":
+                            # no partial subtitles left behind
+                            os.remove(dst)
+                        raise
+                    safe_close(dst_file)
             except OSError as e:
                 if e.errno == errno.EEXIST:
                     logging.warning(
@@ -395,9 +1839,8 @@ class SubtitleArchive(object):
                 else:
                     raise
             else:
-                shutil.copyfileobj(subtitle_file, dst_file)
                 count_of_files_written += 1
-                safe_close(dst_file)
+                self.files_written.append(dst)
 
         return count_of_files_written
 
@@ -467,6 +1910,7 @@ class FilenameBuilder(object):
 
         return dir_, base, ext
 
+    @profiling.profiled
     def build(self, video=None, subtitle=None, num=None):
 
         """
@@ -0,0 +1,164 @@
+"""
+Profiling hooks.
+
+The command line programs profile their whole run on --profile and
+--trace-malloc. Library users may set environment variables instead:
+
+    OPENSUB_PROFILE=FILE
+        Profile calls of the entry points (hash_file, UserAgent.search,
+        SubtitleArchive.extract, FilenameBuilder.build) with cProfile.
+        Dump pstats to FILE at exit. Read it with: python -m pstats FILE
+
+    OPENSUB_TRACE_MALLOC=N
+        Trace memory allocations with tracemalloc (python3 only).
+        Print the top N allocating source lines to stderr at exit.
+"""
+
+import atexit
+import cProfile
+import functools
+import logging
+import os
+import sys
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+_lock = threading.Lock()
+_profile = None
+_profile_path = None
+_whole_run = False
+_owner = None  # thread currently profiled in entry points mode
+_depth = 0
+_trace_malloc = 0
+_registered = False
+
+
+def start(profile=None, trace_malloc=0, whole_run=False):
+
+    """
+    Start profiling. Results are reported at exit or by stop().
+
+    Takes:
+        profile - path to dump pstats to, None to not profile
+        trace_malloc - number of top allocations to report, 0 to not trace
+        whole_run - profile everything from now on (in the calling thread),
+            not just calls of the entry points
+    """
+
+    global _profile, _profile_path, _whole_run, _trace_malloc, _registered
+
+    if profile is not None:
+        _profile = cProfile.Profile()
+        _profile_path = profile
+        _whole_run = whole_run
+        if whole_run:
+            _profile.enable()
+
+    if trace_malloc:
+        if tracemalloc is None:
+            logging.warning("tracemalloc is not available")
+        else:
+            _trace_malloc = trace_malloc
+            tracemalloc.start()
+
+    if not _registered:
+        atexit.register(stop)
+        _registered = True
+
+
+def stop():
+
+    """Stop profiling and report results, if there's anything to report."""
+
+    global _profile, _profile_path, _whole_run, _trace_malloc
+
+    if _profile is not None:
+        with _lock:
+            _profile.disable()
+            _profile.dump_stats(_profile_path)
+            logging.info("profile written to: {}".format(_profile_path))
+            _profile = None
+            _profile_path = None
+            _whole_run = False
+
+    if _trace_malloc:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        sys.stderr.write("top {} allocations:\n".format(_trace_malloc))
+        for stat in snapshot.statistics("lineno")[:_trace_malloc]:
+            sys.stderr.write("{}\n".format(stat))
+        _trace_malloc = 0
+
+
+def _enter():
+
+    """Returns: True if this call has to be profiled (and _leave()-d)."""
+
+    global _owner, _depth
+
+    if _profile is None or _whole_run:
+        return False
+
+    me = threading.current_thread()
+    with _lock:
+        if _owner is None:
+            _owner = me
+            _depth = 1
+            _profile.enable()
+            return True
+        if _owner is me:
+            _depth += 1
+            return True
+        # cProfile can follow one thread at a time.
+        return False
+
+
+def _leave():
+
+    global _owner, _depth
+
+    with _lock:
+        _depth -= 1
+        if _depth == 0:
+            if _profile is not None:
+                _profile.disable()
+            _owner = None
+
+
+def profiled(func):
+
+    """Decorator to mark an entry point for profiling."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enter():
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _leave()
+
+    return wrapper
+
+
+def _trace_malloc_from_env():
+
+    value = os.environ.get("OPENSUB_TRACE_MALLOC") or "0"
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning(
+            "ignoring OPENSUB_TRACE_MALLOC, not a number: {}".format(value))
+        return 0
+
+
+if os.environ.get("OPENSUB_PROFILE") or os.environ.get("OPENSUB_TRACE_MALLOC"):
+    start(
+        profile=os.environ.get("OPENSUB_PROFILE") or None,
+        trace_malloc=_trace_malloc_from_env(),
+        )
@@ -0,0 +1,217 @@
+"""
+Content-addressed store of extracted subtitles.
+
+The same subtitle is often extracted next to many copies of a video.
+With a store, each distinct subtitle is written once (named by the SHA-1
+of its content) and hardlinked to its destinations. Where hardlinks are
+not possible (e.g. across filesystems), a reflink (copy-on-write clone)
+is tried, then a plain copy.
+
+Keep in mind that hardlinked files are one and the same file: editing a
+subtitle in place edits it everywhere, including the store. Editors
+writing a new file and renaming it over the old one are safe.
+"""
+
+import binascii
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst_file):
+
+    """Clone src into the open dst_file. Raises if not supported."""
+
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+
+    with open(src, "rb") as src_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+
+
+class ContentStore(object):
+
+    """Directory of files named by their content."""
+
+    def __init__(self, root, buf_size=64 * 1024):
+
+        """
+        Takes:
+            root - directory of the store, created if missing
+            buf_size - bytes to copy at once
+        """
+
+        self.root = root
+        self.buf_size = buf_size
+
+        try:
+            os.makedirs(root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, digest):
+
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, file_):
+
+        """
+        Store the content of a file, unless already stored.
+
+        Concurrent writers are safe: content is written to a temporary
+        file first, then renamed to its final name atomically.
+
+        Takes:
+            file_ - readable file-like object
+
+        Returns:
+            path of the content in the store
+        """
+
+        sha1 = hashlib.sha1()
+        tmp = tempfile.NamedTemporaryFile(dir=self.root, delete=False)
+        try:
+            with tmp:
+                while True:
+                    buf = file_.read(self.buf_size)
+                    if not buf:
+                        break
+                    sha1.update(buf)
+                    tmp.write(buf)
+
+            path = self._path(sha1.hexdigest())
+            if os.path.exists(path):
+                os.remove(tmp.name)
+            else:
+                try:
+                    os.mkdir(os.path.dirname(path))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.chmod(tmp.name, 0o644)
+                os.rename(tmp.name, path)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+
+        return path
+
+    def _copy_to_temp(self, src, dst):
+
+        """Returns: temporary file in the directory of dst cloning src."""
+
+        tmp = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(dst) or os.curdir, delete=False)
+        try:
+            with tmp:
+                try:
+                    _reflink(src, tmp)
+                except (IOError, OSError):
+                    with open(src, "rb") as src_file:
+                        shutil.copyfileobj(src_file, tmp, self.buf_size)
+            os.chmod(tmp.name, 0o644)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+    def _copy_exclusive(self, src, dst):
+
+        """Create dst, failing if it exists, and fill it with src."""
+
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            with os.fdopen(fd, "wb") as dst_file:
+                try:
+                    _reflink(src, dst_file)
+                except (IOError, OSError):
+                    with open(src, "rb") as src_file:
+                        shutil.copyfileobj(src_file, dst_file, self.buf_size)
+        except BaseException:
+            os.remove(dst)
+            raise
+
+    def link(self, src, dst, overwrite=False):
+
+        """
+        Make dst a hardlink to (or failing that, a copy of) src.
+
+        dst appears atomically: either the old file or the complete
+        new one is there. Except when dst must not be overwritten and
+        its filesystem has no hardlinks at all (e.g. vfat): then dst is
+        created exclusively and filled afterwards.
+
+        Takes:
+            src - path in the store
+            dst - destination path
+            overwrite - allow/disallow to overwrite existing files
+
+        Raises:
+            OSError(EEXIST) - dst exists and overwrite is false
+        """
+
+        if not overwrite:
+            try:
+                os.link(src, dst)
+                return
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    raise
+                logging.debug("can't hardlink {}: {}".format(dst, e))
+
+                if e.errno != errno.EXDEV:
+                    self._copy_exclusive(src, dst)
+                    return
+
+            tmp = self._copy_to_temp(src, dst)
+            try:
+                # link fails with EEXIST, rename would overwrite
+                os.link(tmp, dst)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    raise
+                logging.debug("can't hardlink {}: {}".format(dst, e))
+                self._copy_exclusive(tmp, dst)
+            finally:
+                os.remove(tmp)
+            return
+
+        try:
+            if os.path.samefile(src, dst):
+                # rename() of a hardlink onto itself is a no-op, that
+                # would leave the temporary link behind
+                return
+        except OSError:
+            pass
+
+        tmp = "{}.{}.tmp".format(dst, binascii.hexlify(os.urandom(4)).decode())
+        try:
+            os.link(src, tmp)
+        except OSError as e:
+            logging.debug("can't hardlink {}: {}".format(dst, e))
+            tmp = self._copy_to_temp(src, dst)
+        try:
+            os.rename(tmp, dst)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def install(self, file_, dst, overwrite=False):
+
+        """Store file_ and link it to dst. See put() and link()."""
+
+        self.link(self.put(file_), dst, overwrite=overwrite)
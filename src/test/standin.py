@@ -0,0 +1,283 @@
+"""
+Local stand-ins for remote HTTP servers, so that tests can run offline.
+
+Usage:
+    with StandInServer({"/path": b"body", ...}) as server:
+        server.url("/path")
+        ...
+        server.requests  # list of (method, path, headers) seen
+        server.connections  # count of connections accepted
+
+    with StandInXmlRpcServer(instance) as server:
+        ...  # methods of instance are served at server.url("/xml-rpc")
+
+    with StandInMovie() as sim:
+        ...  # sim.movie can be searched for at sim.server.host
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import opensub
+
+try:
+    import six
+except ImportError:
+    class six(object):
+        PY3 = False
+
+if six.PY3:
+    import http.server as http_server
+    import socketserver
+    import urllib.request as urllib_request
+    import xmlrpc.server as xmlrpc_server
+else:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+    import urllib2 as urllib_request
+    import SimpleXMLRPCServer as xmlrpc_server
+
+
+class _Handler(http_server.BaseHTTPRequestHandler):
+
+    # Keep-alive, so that clients reusing connections can be tested.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args):
+
+        pass
+
+    def setup(self):
+
+        http_server.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def _lookup(self):
+
+        self.server.requests.append(
+            (self.command, self.path, dict(self.headers.items())))
+
+        time.sleep(self.server.delay)
+
+        path = self.path.split("?")[0]
+        if path not in self.server.resources:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        return self.server.resources[path]
+
+    def do_HEAD(self):
+
+        body = self._lookup()
+        if body is None:
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+
+        body = self._lookup()
+        if body is None:
+            return
+
+        match = re.match(
+            r"bytes=(\d+)-(\d+)$", self.headers.get("Range") or "")
+
+        if match and self.server.honour_ranges:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                "bytes {}-{}/{}".format(start, end, len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+
+    daemon_threads = True
+
+
+class _ThreadingXmlRpcServer(
+    socketserver.ThreadingMixIn, xmlrpc_server.SimpleXMLRPCServer):
+
+    daemon_threads = True
+
+
+class _XmlRpcHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
+
+    rpc_paths = ("/xml-rpc",)
+
+    def log_message(self, *_args):
+
+        pass
+
+
+class _Server(object):
+
+    def _serve(self):
+
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+
+    @property
+    def host(self):
+
+        return "{}:{}".format(*self.httpd.server_address)
+
+    def url(self, path):
+
+        return "http://{}{}".format(self.host, path)
+
+    def __enter__(self):
+
+        self.thread.start()
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StandInServer(_Server):
+
+    """HTTP server on 127.0.0.1 serving a dict of path: bytes."""
+
+    def __init__(self, resources, honour_ranges=True, delay=0):
+
+        """
+        Takes:
+            resources - {path: body}
+            honour_ranges - answer Range requests with 206
+            delay - seconds to wait before each response
+        """
+
+        self.httpd = _ThreadingServer(("127.0.0.1", 0), _Handler)
+        self.httpd.resources = resources
+        self.httpd.honour_ranges = honour_ranges
+        self.httpd.delay = delay
+        self.httpd.connections = 0
+        self.httpd.requests = list()
+        self._serve()
+
+    @property
+    def requests(self):
+
+        return self.httpd.requests
+
+    @property
+    def connections(self):
+
+        return self.httpd.connections
+
+
+class StandInXmlRpcServer(_Server):
+
+    """XML-RPC server on 127.0.0.1 serving the methods of an instance."""
+
+    def __init__(self, instance):
+
+        self.httpd = _ThreadingXmlRpcServer(
+            ("127.0.0.1", 0),
+            requestHandler=_XmlRpcHandler,
+            logRequests=False,
+            allow_none=True,
+            )
+        self.httpd.register_instance(instance)
+        self._serve()
+
+
+class _DroppingHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+
+        self.request.recv(64 * 1024)  # close without answering
+
+
+class StandInDroppingServer(_Server):
+
+    """Server on 127.0.0.1 closing each connection without a response."""
+
+    def __init__(self):
+
+        self.httpd = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), _DroppingHandler)
+        self.httpd.daemon_threads = True
+        self._serve()
+
+
+def _read_test_data(name):
+
+    path = os.path.join(os.path.dirname(__file__), "test-data", name)
+    with open(path, "rb") as file_:
+        return file_.read()
+
+
+class StandInMovie(object):
+
+    """
+    A movie of random content in a temporary directory, and a local
+    stand-in server with its search page (test-data/search.xml) and
+    subtitle archive (test-data/4130212.zip).
+    """
+
+    def __init__(self, cd_count=2):
+
+        self.dir = tempfile.mkdtemp()
+        self.movie = list()
+        for cd in range(1, cd_count + 1):
+            path = os.path.join(self.dir, "movie-cd{}.avi".format(cd))
+            with open(path, "wb") as file_:
+                file_.write(os.urandom(3 * 64 * 1024))
+            self.movie.append(path)
+
+        with open(self.movie[0], "rb") as file_:
+            self.hash = opensub.hash_file(file_)
+
+        self.server = StandInServer(dict())
+        self.opener = urllib_request.build_opener(
+            urllib_request.ProxyHandler({}))
+
+        search_xml = _read_test_data("search.xml").replace(
+            b"http://dl.opensubtitles.org",
+            self.server.url("").encode("utf8"))
+
+        self.server.httpd.resources.update({
+            self.search_path(): search_xml,
+            "/en/download/subad/4130212": _read_test_data("4130212.zip"),
+            })
+
+    def search_path(self):
+
+        return ("/en/search/sublanguageid-eng/moviehash-{}/subsumcd-{}"
+                "/simplexml").format(self.hash, len(self.movie))
+
+    def archive_url(self):
+
+        return self.server.url("/en/download/subad/4130212")
+
+    def __enter__(self):
+
+        self.server.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.server.__exit__(*exc_info)
+        shutil.rmtree(self.dir)
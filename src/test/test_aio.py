@@ -0,0 +1,170 @@
+"""
+Tests of the asyncio API, python 3.6+ only.
+
+Coroutines are driven without async/await syntax here, so that this
+module still imports (and skips) on older pythons.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from os.path import join
+
+# Make it possible to run out of the working copy.
+sys.path.insert(0,
+    os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "lib",
+        ))
+
+import opensub
+
+from standin import StandInMovie
+from standin import StandInServer
+
+if sys.version_info >= (3, 6):
+    import asyncio
+
+
+@unittest.skipUnless(sys.version_info >= (3, 6), "needs python 3.6+")
+class AsyncApi(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, coro):
+
+        return self.loop.run_until_complete(coro)
+
+    def test__search_and_extract(self):
+
+        """Search and extract on the event loop."""
+
+        with StandInMovie() as sim:
+            ua = opensub.AsyncUserAgent(
+                server=sim.server.host, opener=sim.opener)
+            results = self._run(ua.search(movie=sim.movie, language="eng"))
+
+            archive = self._run(opensub.AsyncSubtitleArchive(
+                url=results[0].url, opener=sim.opener).__aenter__())
+            try:
+                count = self._run(archive.extract(
+                    movie=sim.movie, builder=opensub.FilenameBuilder()))
+            finally:
+                self._run(archive.__aexit__(None, None, None))
+
+            self.assertEqual(results[0].url, sim.archive_url())
+            self.assertEqual(count, 2)
+            self.assertTrue(os.path.exists(join(sim.dir, "movie-cd1.srt")))
+
+    def test__concurrent_searches(self):
+
+        """Drive many searches concurrently from one loop."""
+
+        with StandInMovie() as sim:
+            ua = opensub.AsyncUserAgent(
+                server=sim.server.host, opener=sim.opener)
+            all_results = self._run(asyncio.gather(*[
+                ua.search(movie=sim.movie, language="eng")
+                for _ in range(20)]))
+
+        self.assertEqual(len(all_results), 20)
+        for results in all_results:
+            self.assertEqual(len(results), 3)
+
+    def test__cache(self):
+
+        """Search and download once through a cache."""
+
+        cache = opensub.MemoryCache()
+        with StandInMovie() as sim:
+            for _ in range(2):
+                ua = opensub.AsyncUserAgent(
+                    server=sim.server.host, opener=sim.opener, cache=cache)
+                results = self._run(
+                    ua.search(movie=sim.movie, language="eng"))
+                with opensub.AsyncSubtitleArchive(
+                    url=results[0].url, opener=sim.opener,
+                    cache=cache) as archive:
+
+                    self._run(archive.download())
+
+            paths = [path for _, path, _ in sim.server.requests]
+
+        self.assertEqual(
+            paths, [sim.search_path(), "/en/download/subad/4130212"])
+
+    def test__hedged_search(self):
+
+        """Take the answer of the mirror when the primary is slow."""
+
+        with StandInMovie() as sim:
+            sim.server.httpd.delay = 2
+            with StandInServer(dict(sim.server.httpd.resources)) as mirror:
+                ua = opensub.AsyncUserAgent(
+                    server=sim.server.host, opener=sim.opener,
+                    mirrors=[mirror.host], hedge_delay=0.05)
+                started = time.time()
+                results = self._run(
+                    ua.search(movie=sim.movie, language="eng"))
+                elapsed = time.time() - started
+
+        self.assertEqual(len(results), 3)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(len(ua.health[mirror.host].response_times), 1)
+
+    def test__hedged_search_failing_primary(self):
+
+        """Turn to the mirror right away, track health."""
+
+        with StandInMovie() as sim:
+            with StandInServer(dict(sim.server.httpd.resources)) as mirror:
+                sim.server.httpd.resources.clear()
+                ua = opensub.AsyncUserAgent(
+                    server=sim.server.host, opener=sim.opener,
+                    mirrors=[mirror.host], hedge_delay=10)
+                results = self._run(
+                    ua.search(movie=sim.movie, language="eng"))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(ua.health[sim.server.host].consecutive_failures, 1)
+        self.assertEqual(ua.servers(), [mirror.host, sim.server.host])
+
+    def test__known_hash(self):
+
+        """Search by the hash given, without reading the movie."""
+
+        with StandInMovie() as sim:
+            ua = opensub.AsyncUserAgent(
+                server=sim.server.host, opener=sim.opener)
+            movie_hash = ua._hash_movie(sim.movie)
+            results = self._run(ua.search(
+                movie=["missing-cd1.avi", "missing-cd2.avi"],
+                language="eng",
+                movie_hash=movie_hash))
+
+        self.assertEqual(len(results), 3)
+
+    def test__http_error(self):
+
+        """Fail on missing search page."""
+
+        with StandInMovie() as sim:
+            ua = opensub.AsyncUserAgent(
+                server=sim.server.host, opener=sim.opener)
+            with self.assertRaises(Exception):
+                self._run(ua.search(movie=sim.movie[1:], language="eng"))
+
+
+if __name__ == "__main__":
+    unittest.main()
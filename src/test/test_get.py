@@ -1,10 +1,11 @@
 """
-TODO test opensub-get
+Test opensub-get against a local stand-in server.
 
 It is recommended to test with a multi-cd movie.
 
-It is a good idea to use a caching http proxy to avoid hitting the
-daily request limit on opensubtitles.org due to testing. For example:
+To test against the real server, it is a good idea to use a caching http
+proxy to avoid hitting the daily request limit on opensubtitles.org due
+to testing. For example:
 
 $ sudo apt-get install polipo  # listens at 127.0.0.1:8123
 
@@ -17,3 +18,168 @@ export http_cache_control="only-if-cached"
 
 python bin/opensub-get -vv -t - >/dev/null -- ...
 """
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Make it possible to run out of the working copy.
+sys.path.insert(0,
+    os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "lib",
+        ))
+
+from standin import StandInMovie
+
+
+def _bin_dir():
+
+    return os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "bin",
+        )
+
+
+def _opensub_get(args, stdin=b""):
+
+    """Returns: exit code and stdout of opensub-get."""
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(_bin_dir(), "opensub-get")] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        )
+    out, _ = process.communicate(stdin)
+    return process.returncode, out
+
+
+class Get(unittest.TestCase):
+
+    def test__multi_cd_movie(self):
+
+        """Write subtitles next to the video files."""
+
+        with StandInMovie() as sim:
+            exit_code, _ = _opensub_get(
+                ["-s", sim.server.host, "--"] + sim.movie)
+
+            self.assertEqual(exit_code, 0)
+            for cd in [1, 2]:
+                self.assertTrue(os.path.exists(
+                    os.path.join(sim.dir, "movie-cd{}.srt".format(cd))))
+
+    def test__no_such_search_result(self):
+
+        """Exit with non-zero when there's no such search result."""
+
+        with StandInMovie() as sim:
+            exit_code, _ = _opensub_get(
+                ["-s", sim.server.host, "-n", "9", "--"] + sim.movie)
+
+        self.assertEqual(exit_code, 1)
+
+    def test__rank(self):
+
+        """Choose search result by rank."""
+
+        with StandInMovie() as sim:
+            _, out = _opensub_get(
+                ["-s", sim.server.host, "--json", "-r", "cds,rating", "--"]
+                + sim.movie)
+            record = json.loads(out)
+
+        self.assertTrue(record["url"].endswith("/3010977"))
+
+    def test__invalid_rank_key(self):
+
+        """Reject unknown rank keys up front, with usage."""
+
+        with StandInMovie() as sim:
+            exit_code, out = _opensub_get(
+                ["-s", sim.server.host, "-r", "cds,size", "--"] + sim.movie)
+
+            self.assertEqual(exit_code, 1)
+            self.assertEqual(out, b"")
+            self.assertEqual(sim.server.requests, [])
+
+    def test__from_stdin_json(self):
+
+        """Stream paths in, records out, one movie per path."""
+
+        with StandInMovie(cd_count=1) as sim:
+            missing = os.path.join(sim.dir, "missing.avi")
+            stdin = "\0".join([sim.movie[0], missing]).encode("utf8")
+
+            exit_code, out = _opensub_get(
+                ["-s", sim.server.host, "--from-stdin", "-0", "--json"],
+                stdin=stdin)
+
+            records = [json.loads(line) for line in out.splitlines()]
+
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(len(records), 2)
+
+        self.assertEqual(records[0]["path"], sim.movie[0])
+        self.assertEqual(records[0]["hash"], sim.hash)
+        self.assertEqual(records[0]["url"], sim.archive_url())
+        self.assertEqual(records[0]["written"],
+                         [os.path.join(sim.dir, "movie-cd1.srt")])
+        self.assertIsNone(records[0]["error"])
+        self.assertEqual(
+            sorted(records[0]["timings"]), ["extract", "hash", "search"])
+
+        self.assertEqual(records[1]["path"], missing)
+        self.assertIsNotNone(records[1]["error"])
+
+    def test__archive_limits(self):
+
+        """Refuse oversized subtitles, leaving nothing half written."""
+
+        with StandInMovie() as sim:
+            exit_code, out = _opensub_get(
+                ["-s", sim.server.host, "--json", "--max-subtitle-size=100",
+                 "--"] + sim.movie)
+            record = json.loads(out)
+
+            self.assertEqual(
+                sorted(os.listdir(sim.dir)),
+                ["movie-cd1.avi", "movie-cd2.avi"])
+
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(record["written"], [])
+        self.assertIn("larger than 100 bytes", record["error"])
+
+    def test__verify_parts(self):
+
+        """Check the parts of the movie before writing anything."""
+
+        with StandInMovie() as sim:
+            exit_code, out = _opensub_get(
+                ["-s", sim.server.host, "--json", "--verify-parts", "--"]
+                + sim.movie)
+            record = json.loads(out)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(len(record["written"]), 2)
+        self.assertIn("pair", record["timings"])
+
+        with StandInMovie(cd_count=3) as sim:
+            exit_code, out = _opensub_get(
+                ["-s", sim.server.host, "--json", "--verify-parts", "--"]
+                + sim.movie)
+            record = json.loads(out)
+
+            self.assertEqual(len(os.listdir(sim.dir)), 3)
+
+        self.assertEqual(exit_code, 1)
+        self.assertIn(
+            "2 subtitle file(s) for 3 video file(s)", record["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,11 @@
+import io
+import json
 import os
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import unittest
 
 try:
@@ -24,6 +28,10 @@ sys.path.insert(0,
         ))
 
 import opensub
+import opensub.bulk
+import opensub.main
+
+from standin import StandInServer
 
 
 def _bin_dir():
@@ -125,5 +133,470 @@ class MovieHash(unittest.TestCase):
         self.assertEqual(out, expected)
 
 
+class StreamHash(unittest.TestCase):
+
+    def setUp(self):
+
+        """Create a random file of odd size."""
+
+        self.data = os.urandom(3 * 64 * 1024 + 4 * 1001)
+        self.tmpfile = tempfile.NamedTemporaryFile()
+        self.tmpfile.write(self.data)
+        self.tmpfile.flush()
+        self.tmpfile.seek(0)
+        self.expected = opensub.hash_file(self.tmpfile)
+
+    def tearDown(self):
+
+        self.tmpfile.close()
+
+    def test__same_hash_as_hash_file(self):
+
+        """Yield the same hash whatever way the data is fed."""
+
+        for buf_size in [1001, 64 * 1024, 64 * 1024 + 1, len(self.data)]:
+            hasher = opensub.StreamHasher()
+            for pos in range(0, len(self.data), buf_size):
+                hasher.update(self.data[pos:pos + buf_size])
+            self.assertEqual(hasher.hexdigest(), self.expected)
+
+    def test__hash_stream(self):
+
+        """Hash a file-like object read sequentially."""
+
+        self.assertEqual(opensub.hash_stream(self.tmpfile), self.expected)
+
+    def test__stream_too_small(self):
+
+        """Fail to hash streams < 128 KiB."""
+
+        hasher = opensub.StreamHasher()
+        hasher.update(self.data[:2 * 64 * 1024 - 1])
+        with self.assertRaises(Exception):
+            hasher.hexdigest()
+
+    def test__cli_stdin(self):
+
+        """Hash standard input via command line interface."""
+
+        expected = "{} -\n".format(self.expected).encode("utf8")
+
+        out = subprocess.check_output([
+            sys.executable,
+            os.path.join(_bin_dir(), "opensub-hash"),
+            "-"],
+            stdin=self.tmpfile,
+            )
+
+        self.assertEqual(out, expected)
+
+    def test__cli_profile(self):
+
+        """Dump profile of a run via command line interface."""
+
+        profile = self.tmpfile.name + ".profile"
+        try:
+            subprocess.check_output([
+                sys.executable,
+                os.path.join(_bin_dir(), "opensub-hash"),
+                "--profile", profile,
+                "-"],
+                stdin=self.tmpfile,
+                )
+            self.assertTrue(os.path.getsize(profile) > 0)
+        finally:
+            if os.path.exists(profile):
+                os.remove(profile)
+
+
+class PathsFromStdin(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = os.urandom(2 * 64 * 1024)
+        self.tmpfile = tempfile.NamedTemporaryFile()
+        self.tmpfile.write(self.data)
+        self.tmpfile.flush()
+        self.expected = opensub.hash_file(self.tmpfile)
+
+    def tearDown(self):
+
+        self.tmpfile.close()
+
+    def test__cli_from_stdin_json(self):
+
+        """Read NUL separated paths, write a JSON record per path."""
+
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(_bin_dir(), "opensub-hash"),
+            "--from-stdin", "-0", "--json"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            )
+        stdin = "{0}\0no-such-file\0{0}\0".format(self.tmpfile.name)
+        out, _ = process.communicate(stdin.encode("utf8"))
+        records = [json.loads(line) for line in out.splitlines()]
+
+        self.assertNotEqual(process.returncode, 0)
+        self.assertEqual(
+            [record["path"] for record in records],
+            [self.tmpfile.name, "no-such-file", self.tmpfile.name])
+        self.assertEqual(records[0]["hash"], self.expected)
+        self.assertEqual(records[0]["size"], len(self.data))
+        self.assertIsNone(records[0]["error"])
+        self.assertIsNotNone(records[1]["error"])
+
+    def test__cli_slow_producer(self):
+
+        """Print each record as soon as its path arrives, not in bulk."""
+
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(_bin_dir(), "opensub-hash"),
+            "--from-stdin", "--json"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            )
+        lines = list()
+
+        def read_line():
+            lines.append(process.stdout.readline())
+
+        try:
+            process.stdin.write(
+                "{}\n".format(self.tmpfile.name).encode("utf8"))
+            process.stdin.flush()
+
+            reader = threading.Thread(target=read_line)
+            reader.daemon = True
+            reader.start()
+            reader.join(timeout=10)
+            self.assertTrue(lines, "first record held back")
+        finally:
+            out, _ = process.communicate(
+                "{}\n".format(self.tmpfile.name).encode("utf8"))
+
+        records = [json.loads(line) for line in lines + out.splitlines()]
+        self.assertEqual(
+            [record["hash"] for record in records], [self.expected] * 2)
+
+    def test__iter_paths(self):
+
+        """Split on newlines or NULs, skip empty paths."""
+
+        self.assertEqual(
+            list(opensub.main.iter_paths(io.BytesIO(b"a b\n\nc\n"))),
+            ["a b", "c"])
+        self.assertEqual(
+            list(opensub.main.iter_paths(
+                io.BytesIO(b"a\nb\0\0c"), null=True)),
+            ["a\nb", "c"])
+
+
+class BulkHash(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.paths = list()
+        self.expected = list()
+
+        for num in range(5):
+            path = os.path.join(self.dir, "video{}.avi".format(num))
+            with open(path, "w+b") as file_:
+                file_.write(os.urandom(2 * 64 * 1024 + num))
+                self.expected.append(opensub.hash_file(file_))
+            self.paths.append(path)
+
+        self.small = os.path.join(self.dir, "small.avi")
+        with open(self.small, "wb") as file_:
+            file_.write(b"x")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def test__same_hashes_in_requested_order(self):
+
+        """Report results in argument order, whatever the read order."""
+
+        paths = list(reversed(self.paths))
+        for schedule in [True, False]:
+            results = list(opensub.hash_files(
+                paths, schedule=schedule, batch_size=2))
+            self.assertEqual([result[0] for result in results], paths)
+            self.assertEqual(
+                [result[1] for result in results],
+                list(reversed(self.expected)))
+
+    def test__errors_per_file(self):
+
+        """Report errors per file without stopping."""
+
+        paths = [self.paths[0], self.small, "no-such-file", self.paths[1]]
+        results = list(opensub.hash_files(paths))
+
+        self.assertEqual(results[0][1:], (self.expected[0], None))
+        self.assertIsNotNone(results[1][2])
+        self.assertIsNotNone(results[2][2])
+        self.assertEqual(results[3][1:], (self.expected[1], None))
+
+    def test__with_size(self):
+
+        """Yield the sizes seen while hashing, None where unknown."""
+
+        results = list(opensub.hash_files(
+            [self.paths[1], "no-such-file"], with_size=True))
+
+        self.assertEqual(
+            results[0], (self.paths[1], self.expected[1], 2 * 64 * 1024 + 1,
+                         None))
+        self.assertEqual(results[1][1:3], (None, None))
+        self.assertIsInstance(results[1][3], EnvironmentError)
+
+    def test__locality_key(self):
+
+        """Get a sortable locality key with or without FIEMAP."""
+
+        key, stat = opensub.bulk._plan(self.paths[0])
+        self.assertEqual(stat.st_size, 2 * 64 * 1024)
+        self.assertEqual(len(key), 3)
+
+    @unittest.skipUnless(sys.version_info >= (3,), "needs python 3")
+    def test__processes(self):
+
+        """Same results, errors included, from worker processes."""
+
+        paths = self.paths + [self.small, "no-such-file"]
+        results = list(opensub.hash_files(paths, batch_size=4, processes=2))
+
+        self.assertEqual([result[0] for result in results], paths)
+        self.assertEqual(
+            [result[1] for result in results], self.expected + [None, None])
+        self.assertIsInstance(results[-2][2], Exception)
+        self.assertIsInstance(results[-1][2], EnvironmentError)
+
+    @unittest.skipUnless(sys.version_info >= (3,), "needs python 3")
+    def test__shared_executor(self):
+
+        """Hash in the workers of an executor shared across calls."""
+
+        executor = opensub.process_executor(2)
+        try:
+            for _ in range(2):
+                results = list(opensub.hash_files(
+                    self.paths, batch_size=2, executor=executor))
+                self.assertEqual(
+                    [result[1] for result in results], self.expected)
+        finally:
+            executor.shutdown()
+
+    @unittest.skipUnless(sys.version_info >= (3,), "needs python 3")
+    def test__worker_dies(self):
+
+        """Report tasks lost with a worker as errors instead of hanging."""
+
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor = opensub.process_executor(2)
+        try:
+            outcomes = list(opensub.bulk._map_or_error(
+                executor, os._exit, [1, 1, 1], 2,
+                opensub.bulk._hash_failed))
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(len(outcomes), 3)
+        for hash_, error in outcomes:
+            self.assertIsNone(hash_)
+            self.assertIsInstance(error, BrokenProcessPool)
+
+    def test__cache(self):
+
+        """Hash files once, look them up in the cache afterwards."""
+
+        cache = opensub.MemoryCache()
+        results = list(opensub.hash_files(self.paths, cache=cache))
+        self.assertEqual([result[1] for result in results], self.expected)
+        self.assertEqual(len(cache._items), len(self.paths))
+
+        # Prove that the cache is used by poisoning it.
+        for key in list(cache._items):
+            cache.set(key, b"0" * 16)
+        results = list(opensub.hash_files(self.paths, cache=cache))
+        self.assertEqual(
+            [result[1] for result in results], ["0" * 16] * len(self.paths))
+
+        # Modified files are hashed again.
+        with open(self.paths[0], "ab") as file_:
+            file_.write(b"x")
+        self.assertNotEqual(
+            opensub.hash_path(self.paths[0], cache=cache)[0], "0" * 16)
+
+
+class Duplicates(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.paths = list()
+
+        data = [os.urandom(2 * 64 * 1024) for _ in range(2)]
+        for num, content in enumerate([data[0], data[1], data[0]]):
+            path = os.path.join(self.dir, "video{}.avi".format(num))
+            with open(path, "wb") as file_:
+                file_.write(content)
+            self.paths.append(path)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def test__find_duplicates(self):
+
+        """Group files of the same hash, report errors separately."""
+
+        index, errors = opensub.find_duplicates(
+            self.paths + ["no-such-file"])
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual([path for path, _ in errors], ["no-such-file"])
+
+        duplicates = list(index.duplicates())
+        self.assertEqual(len(duplicates), 1)
+        hash_, files = duplicates[0]
+        self.assertEqual(files, [
+            (self.paths[0], 2 * 64 * 1024),
+            (self.paths[2], 2 * 64 * 1024),
+            ])
+
+    def test__compact_storage(self):
+
+        """Store hashes and sizes as 64 bit integers."""
+
+        index = opensub.HashIndex()
+        index.add("a", "ffffffffffffffff", 1)
+        index.add("b", "0000000000000001", 2)
+        index.add("c", "ffffffffffffffff", 3)
+
+        self.assertEqual(index.hashes.itemsize, 8)
+        self.assertEqual(
+            list(index.duplicates()),
+            [("ffffffffffffffff", [("a", 1), ("c", 3)])])
+
+    def test__many_buckets(self):
+
+        """Group in hash order across buckets, however small they are."""
+
+        index = opensub.HashIndex()
+        hashes = [(num * 0x9e3779b97f4a7c15) % 2 ** 64 for num in range(300)]
+        for num, hash_ in enumerate(hashes * 2):
+            index.add(str(num), "{:016x}".format(hash_), num)
+
+        duplicates = list(index.duplicates(bucket_size=16))
+
+        self.assertEqual(
+            [hash_ for hash_, _ in duplicates],
+            ["{:016x}".format(hash_) for hash_ in sorted(hashes)])
+        self.assertEqual(
+            duplicates[0][1], [("0", 0), (str(len(hashes)), len(hashes))])
+
+    def test__cli_duplicates(self):
+
+        """Print sets of duplicates via command line interface."""
+
+        out = subprocess.check_output([
+            sys.executable,
+            os.path.join(_bin_dir(), "opensub-hash"),
+            "--duplicates", "--json"] + self.paths)
+        records = [json.loads(line) for line in out.splitlines()]
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            records[0]["paths"], [self.paths[0], self.paths[2]])
+
+
+class RemoteHash(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = os.urandom(5 * 64 * 1024 + 3)
+        self.small = os.urandom(100)
+
+        with tempfile.TemporaryFile() as file_:
+            file_.write(self.data)
+            self.expected = opensub.hash_file(file_)
+
+        self.opener = urllib_request.build_opener(
+            urllib_request.ProxyHandler({}))
+
+    def test__hash_url(self):
+
+        """Same hash as local, but reading only the two chunks."""
+
+        with StandInServer({"/video.avi": self.data}) as server:
+            hash_ = opensub.hash_url(
+                server.url("/video.avi"), opener=self.opener)
+            methods = [request[0] for request in server.requests]
+
+        self.assertEqual(hash_, self.expected)
+        self.assertEqual(methods, ["HEAD", "GET", "GET"])
+
+    def test__range_not_honoured(self):
+
+        """Fail instead of downloading whole files."""
+
+        with StandInServer(
+            {"/video.avi": self.data}, honour_ranges=False) as server:
+
+            with self.assertRaises(Exception):
+                opensub.hash_url(server.url("/video.avi"), opener=self.opener)
+
+    def test__hash_urls(self):
+
+        """Hash concurrently, report errors per URL, keep order."""
+
+        resources = {"/video.avi": self.data, "/small.avi": self.small}
+        with StandInServer(resources) as server:
+            urls = [
+                server.url("/video.avi"),
+                server.url("/small.avi"),
+                server.url("/missing.avi"),
+                server.url("/video.avi"),
+                ]
+            results = list(
+                opensub.hash_urls(urls, opener=self.opener, jobs=3))
+
+        self.assertEqual([result[0] for result in results], urls)
+        self.assertEqual(results[0][1], self.expected)
+        self.assertEqual(results[3][1], self.expected)
+        self.assertIsNotNone(results[1][2])
+        self.assertIsNotNone(results[2][2])
+
+    def test__cli_url(self):
+
+        """Hash remote and local files via command line interface."""
+
+        with tempfile.NamedTemporaryFile() as file_:
+            file_.write(self.data)
+            file_.flush()
+
+            with StandInServer({"/video.avi": self.data}) as server:
+                out = subprocess.check_output([
+                    sys.executable,
+                    os.path.join(_bin_dir(), "opensub-hash"),
+                    server.url("/video.avi"),
+                    file_.name,
+                    ])
+
+            expected = "{0} {1}\n{0} {2}\n".format(
+                self.expected, server.url("/video.avi"), file_.name)
+
+        self.assertEqual(out, expected.encode("utf8"))
+
+
 if __name__ == "__main__":
     unittest.main()
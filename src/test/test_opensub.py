@@ -1,8 +1,14 @@
 import errno
+import io
 import os
+import pstats
+import shutil
+import subprocess
 import sys
 import tempfile
+import time
 import unittest
+import zipfile
 
 from os.path import join
 
@@ -16,6 +22,23 @@ sys.path.insert(0,
 
 import opensub
 import opensub.main
+import opensub.profiling
+
+from standin import StandInDroppingServer
+from standin import StandInMovie
+from standin import StandInServer
+from standin import StandInXmlRpcServer
+
+try:
+    import six
+except ImportError:
+    class six(object):
+        PY3 = False
+
+if six.PY3:
+    import urllib.request as urllib_request
+else:
+    import urllib2 as urllib_request
 
 
 def _test_data_dir():
@@ -26,6 +49,879 @@ def _test_data_dir():
         )
 
 
+class Search(unittest.TestCase):
+
+    def test__search_results(self):
+
+        """Find archive URLs in the search page, in order."""
+
+        with StandInMovie() as sim:
+            ua = opensub.UserAgent(server=sim.server.host, opener=sim.opener)
+            results = ua.search(movie=sim.movie, language="eng")
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0].url, sim.archive_url())
+
+    def test__search_result_fields(self):
+
+        """Parse fields of search results."""
+
+        with StandInMovie() as sim:
+            ua = opensub.UserAgent(server=sim.server.host, opener=sim.opener)
+            result = ua.search(movie=sim.movie, language="eng")[1]
+
+        self.assertEqual(result.cd_count, 1)
+        self.assertEqual(result.format, "sub")
+        self.assertEqual(result.rating, 8.5)
+        self.assertEqual(result.downloads, 4417)
+
+    def test__rank(self):
+
+        """Rank by cd count match first, then rating."""
+
+        with StandInMovie() as sim:
+            ua = opensub.UserAgent(server=sim.server.host, opener=sim.opener)
+            results = ua.search(movie=sim.movie, language="eng")
+
+        ranked = opensub.rank_search_results(
+            results, keys=["cds", "rating"], cd_count=2)
+        self.assertEqual(
+            [result.url for result in ranked],
+            [results[2].url, results[0].url, results[1].url])
+
+        ranked = opensub.rank_search_results(results, keys=["downloads"])
+        self.assertEqual(
+            [result.downloads for result in ranked], [4417, 1290, 815])
+
+    def test__empty_fields(self):
+
+        """Take empty fields as missing, rank them last."""
+
+        parser = opensub.main._SearchPageParser()
+        parser.feed(
+            b"<search><results>"
+            b"<subtitle><download>a</download><subrating></subrating>"
+            b"<downloads/></subtitle>"
+            b"<subtitle><download>b</download><subrating>1.0</subrating>"
+            b"<downloads>5</downloads></subtitle>"
+            b"</results></search>")
+        results = parser.close()
+
+        self.assertIsNone(results[0].rating)
+        self.assertIsNone(results[0].downloads)
+        ranked = opensub.rank_search_results(
+            results, keys=["rating", "downloads"])
+        self.assertEqual([result.url for result in ranked], ["b", "a"])
+
+
+class HedgedSearch(unittest.TestCase):
+
+    def _search(self, sim, mirror, **kwargs):
+
+        ua = opensub.UserAgent(
+            server=sim.server.host,
+            opener=sim.opener,
+            mirrors=[mirror.host],
+            **kwargs)
+
+        started = time.time()
+        results = ua.search(movie=sim.movie, language="eng")
+        return ua, results, time.time() - started
+
+    def test__slow_primary(self):
+
+        """Take the answer of the mirror when the primary is slow."""
+
+        with StandInMovie() as sim:
+            sim.server.httpd.delay = 2
+            with StandInServer(dict(sim.server.httpd.resources)) as mirror:
+                _, results, elapsed = self._search(
+                    sim, mirror, hedge_delay=0.05)
+
+        self.assertEqual(len(results), 3)
+        self.assertLess(elapsed, 1)
+
+    def test__fast_primary(self):
+
+        """Do not bother the mirror when the primary answers in time."""
+
+        with StandInMovie() as sim:
+            with StandInServer(dict(sim.server.httpd.resources)) as mirror:
+                self._search(sim, mirror, hedge_delay=1)
+                self.assertEqual(mirror.requests, [])
+
+    def test__failing_primary(self):
+
+        """Turn to the mirror right away, track health."""
+
+        with StandInMovie() as sim:
+            with StandInServer(dict(sim.server.httpd.resources)) as mirror:
+                sim.server.httpd.resources.clear()
+                ua, results, elapsed = self._search(
+                    sim, mirror, hedge_delay=10)
+
+        self.assertEqual(len(results), 3)
+        self.assertLess(elapsed, 5)
+        self.assertEqual(ua.health[sim.server.host].consecutive_failures, 1)
+        self.assertEqual(ua.servers(), [mirror.host, sim.server.host])
+
+    def test__p95(self):
+
+        """Default delay until there are enough samples, p95 after."""
+
+        health = opensub.main.ServerHealth(default_delay=3)
+        self.assertEqual(health.p95(), 3)
+        for response_time in range(100):
+            health.succeeded(response_time)
+        self.assertEqual(health.p95(), 94)
+
+
+class WarmConnection(unittest.TestCase):
+
+    def setUp(self):
+
+        self.opener = opensub.WarmOpener(
+            fallback=urllib_request.build_opener(
+                urllib_request.ProxyHandler({})))
+
+    def test__search_and_download_on_one_connection(self):
+
+        """Connect in advance, then reuse the connection."""
+
+        with StandInMovie() as sim:
+            self.opener.warm(sim.server.host)
+
+            ua = opensub.UserAgent(server=sim.server.host, opener=self.opener)
+            results = ua.search(movie=sim.movie, language="eng")
+
+            with opensub.SubtitleArchive(
+                url=results[0].url, opener=self.opener) as archive:
+
+                count = archive.extract(
+                    movie=sim.movie, builder=opensub.FilenameBuilder())
+
+            self.assertEqual(count, 2)
+            self.assertEqual(sim.server.connections, 1)
+
+    def test__http_error(self):
+
+        """Raise like urllib(2) does, keep the connection."""
+
+        with StandInServer({"/": b"ok"}) as server:
+            with self.assertRaises(urllib_request.HTTPError) as cm:
+                self.opener.open(server.url("/missing"))
+            self.assertEqual(cm.exception.code, 404)
+
+            response = self.opener.open(server.url("/"))
+            self.assertEqual(response.read(), b"ok")
+            response.close()
+
+            self.assertEqual(server.connections, 1)
+
+    def test__unread_response(self):
+
+        """Do not reuse a connection with a response left unread."""
+
+        with StandInServer({"/": b"ok"}) as server:
+            self.opener.open(server.url("/")).close()
+            response = self.opener.open(server.url("/"))
+            self.assertEqual(response.read(), b"ok")
+            response.close()
+
+            self.assertEqual(server.connections, 2)
+
+
+def _urls(results_of_movies):
+
+    return [[result.url for result in results]
+            for results in results_of_movies]
+
+
+class StandInOSDb(object):
+
+    """The xml-rpc methods of opensubtitles.org we use."""
+
+    def __init__(self, subtitles):
+
+        """
+        Takes:
+            subtitles - {movie hash: [(cd count, archive url), ...]}
+        """
+
+        self.subtitles = subtitles
+        self.searches = list()
+        self.user_agents = list()
+
+    def LogIn(self, _username, _password, _language, useragent):
+
+        self.user_agents.append(useragent)
+        return {"status": "200 OK", "token": "t0k3n"}
+
+    def SearchSubtitles(self, token, queries):
+
+        assert token == "t0k3n"
+        self.searches.append(queries)
+
+        data = list()
+        for query in queries:
+            for cd_count, url in self.subtitles.get(query["moviehash"], []):
+                for cd in range(1, cd_count + 1):
+                    data.append({
+                        "MovieHash": query["moviehash"],
+                        "SubSumCD": str(cd_count),
+                        "SubActualCD": str(cd),
+                        "ZipDownloadLink": url,
+                        "SubRating": "7.5",
+                        })
+
+        return {"status": "200 OK", "data": data or False}
+
+
+class SearchMany(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.movies = list()
+        self.hashes = list()
+        for num in range(5):
+            path = join(self.dir, "movie{}.avi".format(num))
+            with open(path, "w+b") as file_:
+                file_.write(os.urandom(2 * 64 * 1024))
+                self.hashes.append(opensub.hash_file(file_))
+            self.movies.append([path])
+
+        self.opener = urllib_request.build_opener(
+            urllib_request.ProxyHandler({}))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def test__batches(self):
+
+        """Search in batches, map results back to movies."""
+
+        osdb = StandInOSDb({
+            self.hashes[0]: [(1, "http://dl/0a"), (1, "http://dl/0b")],
+            self.hashes[3]: [(1, "http://dl/3"), (2, "http://dl/3-2cd")],
+            })
+
+        with StandInXmlRpcServer(osdb) as server:
+            ua = opensub.UserAgent(server=server.host, opener=self.opener)
+            outcomes = ua.search_many(self.movies, "eng", batch_size=2)
+
+        results = [results for results, _ in outcomes]
+        self.assertEqual(_urls(results), [
+            ["http://dl/0a", "http://dl/0b"], [], [], ["http://dl/3"], []])
+        self.assertEqual([len(queries) for queries in osdb.searches],
+                         [2, 2, 1])
+
+    def test__multi_cd(self):
+
+        """Match cd count, list each multi-cd archive once."""
+
+        osdb = StandInOSDb({self.hashes[0]: [(2, "http://dl/0-2cd")]})
+
+        with StandInXmlRpcServer(osdb) as server:
+            ua = opensub.UserAgent(server=server.host, opener=self.opener)
+            outcomes = ua.search_many(
+                [self.movies[0] + self.movies[1]], "eng")
+
+        results = [results for results, _ in outcomes]
+        self.assertEqual(_urls(results), [["http://dl/0-2cd"]])
+        self.assertEqual(results[0][0].cd_count, 2)
+        self.assertEqual(results[0][0].rating, 7.5)
+
+    def test__fallback_to_search(self):
+
+        """Search movie by movie, if the server lacks xml-rpc."""
+
+        with StandInMovie() as sim:
+            ua = opensub.UserAgent(server=sim.server.host, opener=sim.opener)
+            outcomes = ua.search_many([sim.movie, sim.movie], "eng")
+            expected = ua.search(sim.movie, "eng")
+
+        results = [results for results, _ in outcomes]
+        self.assertEqual(_urls(results), _urls([expected, expected]))
+
+    def test__errors_per_movie(self):
+
+        """Report unreadable movies, search for the rest."""
+
+        osdb = StandInOSDb({self.hashes[1]: [(1, "http://dl/1")]})
+        missing = [join(self.dir, "missing.avi")]
+
+        with StandInXmlRpcServer(osdb) as server:
+            ua = opensub.UserAgent(server=server.host, opener=self.opener)
+            outcomes = ua.search_many(
+                [missing, self.movies[1]], "eng")
+
+        self.assertIsNone(outcomes[0][0])
+        self.assertIsInstance(outcomes[0][1], EnvironmentError)
+        self.assertEqual(_urls([outcomes[1][0]]), [["http://dl/1"]])
+        self.assertIsNone(outcomes[1][1])
+
+    def test__later_batch_fails(self):
+
+        """Keep the batches answered, search the failed one one by one."""
+
+        osdb = FailingOSDb(
+            {self.hashes[0]: [(1, "http://dl/0")]}, fail_from=2)
+
+        with StandInXmlRpcServer(osdb) as server:
+            ua = opensub.UserAgent(server=server.host, opener=self.opener)
+            outcomes = ua.search_many(self.movies[:4], "eng", batch_size=2)
+
+        self.assertEqual(_urls([outcomes[0][0]]), [["http://dl/0"]])
+        self.assertEqual(outcomes[1], ([], None))
+        # There is no simplexml search page on the xml-rpc server.
+        for results, error in outcomes[2:]:
+            self.assertIsNone(results)
+            self.assertIsNotNone(error)
+
+    def test__xmlrpc_settings(self):
+
+        """Use the xml-rpc url and user agent given."""
+
+        osdb = StandInOSDb({self.hashes[0]: [(1, "http://dl/0")]})
+
+        with StandInXmlRpcServer(osdb) as server:
+            ua = opensub.UserAgent(
+                server="localhost.invalid",
+                opener=self.opener,
+                xmlrpc_url=server.url("/xml-rpc"),
+                xmlrpc_user_agent="registered v1",
+                )
+            outcomes = ua.search_many(self.movies[:1], "eng")
+
+        self.assertEqual(_urls([outcomes[0][0]]), [["http://dl/0"]])
+        self.assertEqual(osdb.user_agents, ["registered v1"])
+
+    def test__dropped_connection(self):
+
+        """Report errors per movie when the server hangs up."""
+
+        with StandInDroppingServer() as server:
+            ua = opensub.UserAgent(server=server.host, opener=self.opener)
+            outcomes = ua.search_many(self.movies[:2], "eng")
+            part_names = ua.part_names(
+                [(self.hashes[0], 2 * 64 * 1024)], "eng", "7")
+
+        for results, error in outcomes:
+            self.assertIsNone(results)
+            self.assertIsNotNone(error)
+        self.assertIsNone(part_names)
+
+
+class FailingOSDb(StandInOSDb):
+
+    """StandInOSDb failing searches from the fail_from-th on."""
+
+    def __init__(self, subtitles, fail_from):
+
+        StandInOSDb.__init__(self, subtitles)
+        self.fail_from = fail_from
+
+    def SearchSubtitles(self, token, queries):
+
+        if len(self.searches) + 1 >= self.fail_from:
+            self.searches.append(queries)
+            return {"status": "503 Service Unavailable"}
+        return StandInOSDb.SearchSubtitles(self, token, queries)
+
+
+class StandInPartsOSDb(StandInOSDb):
+
+    """xml-rpc search answering with a row per known part."""
+
+    def __init__(self, rows):
+
+        """
+        Takes:
+            rows - list of xml-rpc search response rows
+        """
+
+        StandInOSDb.__init__(self, dict())
+        self.rows = rows
+
+    def SearchSubtitles(self, token, queries):
+
+        hashes = [query["moviehash"] for query in queries]
+        return {
+            "status": "200 OK",
+            "data": [row for row in self.rows if row["MovieHash"] in hashes],
+            }
+
+
+class Parts(unittest.TestCase):
+
+    names = ["Birdman of Alcatraz - 1.srt", "Birdman of Alcatraz - 2.srt"]
+
+    def test__hash_parts(self):
+
+        with StandInMovie() as sim:
+            parts = [part.get() for part in opensub.hash_parts(sim.movie)]
+
+            self.assertEqual(
+                parts, [opensub.hash_path(path) for path in sim.movie])
+
+    def test__pair_in_natural_order(self):
+
+        with StandInMovie() as sim:
+            with opensub.SubtitleArchive(
+                url=sim.archive_url(), opener=sim.opener) as archive:
+
+                self.assertEqual(
+                    archive.pair(sim.movie), list(zip(sim.movie, self.names)))
+
+    def test__missing_part(self):
+
+        """Refuse to pair before writing anything."""
+
+        with StandInMovie(cd_count=3) as sim:
+            with opensub.SubtitleArchive(
+                url=sim.archive_url(), opener=sim.opener) as archive:
+
+                with self.assertRaises(opensub.PartMismatch):
+                    archive.pair(sim.movie)
+
+            self.assertEqual(len(os.listdir(sim.dir)), 3)
+
+    def test__pair_by_name(self):
+
+        """Follow the names of the parts, whatever the natural order."""
+
+        with StandInMovie() as sim:
+            with opensub.SubtitleArchive(
+                url=sim.archive_url(), opener=sim.opener) as archive:
+
+                pairs = archive.pair(
+                    sim.movie, part_names=[self.names[1], None])
+                count = archive.extract(
+                    movie=sim.movie,
+                    builder=opensub.FilenameBuilder(),
+                    pairs=pairs,
+                    )
+
+                with archive.zipfile.open(self.names[1]) as file_:
+                    expected = file_.read()
+
+            self.assertEqual(pairs, list(zip(sim.movie, reversed(self.names))))
+            self.assertEqual(count, 2)
+            with open(join(sim.dir, "movie-cd1.srt"), "rb") as file_:
+                self.assertEqual(file_.read(), expected)
+
+            with opensub.SubtitleArchive(
+                url=sim.archive_url(), opener=sim.opener) as archive:
+
+                with self.assertRaises(opensub.PartMismatch):
+                    archive.pair(sim.movie, part_names=["other.srt", None])
+
+    def test__part_names(self):
+
+        """Look up the subtitle of each part, spot parts of other files."""
+
+        parts = [("{:016x}".format(num), 1000 + num) for num in [1, 2]]
+        rows = [
+            {"IDSubtitle": "7", "MovieHash": parts[0][0],
+             "SubFileName": "b.srt"},
+            {"IDSubtitle": "7", "MovieHash": parts[1][0],
+             "SubFileName": "a.srt"},
+            {"IDSubtitle": "8", "MovieHash": parts[0][0],
+             "SubFileName": "c.srt"},
+            ]
+        opener = urllib_request.build_opener(urllib_request.ProxyHandler({}))
+
+        with StandInXmlRpcServer(StandInPartsOSDb(rows)) as server:
+            ua = opensub.UserAgent(server=server.host, opener=opener)
+
+            self.assertEqual(
+                ua.part_names(parts, "eng", "7"), ["b.srt", "a.srt"])
+            with self.assertRaises(opensub.PartMismatch):
+                ua.part_names(parts, "eng", "8")
+
+        with StandInServer(dict()) as server:
+            ua = opensub.UserAgent(server=server.host, opener=opener)
+            self.assertIsNone(ua.part_names(parts, "eng", "7"))
+
+
+class ExtractFromServer(unittest.TestCase):
+
+    def test__extract_next_to_movie(self):
+
+        """Download archive and write subtitles next to video files."""
+
+        with StandInMovie() as sim:
+            with opensub.SubtitleArchive(
+                url=sim.archive_url(), opener=sim.opener) as archive:
+
+                count = archive.extract(
+                    movie=sim.movie, builder=opensub.FilenameBuilder())
+
+            self.assertEqual(count, 2)
+            self.assertTrue(os.path.exists(join(sim.dir, "movie-cd2.srt")))
+
+
+def _zip(members):
+
+    """Returns: bytes of a zip archive of {name: content}."""
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zip_:
+        for name, content in sorted(members.items()):
+            zip_.writestr(name, content)
+    return buf.getvalue()
+
+
+class ArchiveLimits(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.movie = [join(self.dir, "movie-cd1.avi")]
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def _extract(self, members, **limits):
+
+        with StandInServer({"/sub.zip": _zip(members)}) as server:
+            with opensub.SubtitleArchive(
+                url=server.url("/sub.zip"),
+                opener=urllib_request.build_opener(
+                    urllib_request.ProxyHandler({})),
+                buf_size=1024,
+                **limits) as archive:
+
+                return archive.extract(
+                    movie=self.movie, builder=opensub.FilenameBuilder())
+
+    def test__within_limits(self):
+
+        count = self._extract(
+            {"a.srt": b"x" * 4096},
+            max_archive_size=4096, max_members=1, max_member_size=4096)
+
+        self.assertEqual(count, 1)
+
+    def test__archive_size(self):
+
+        with self.assertRaises(opensub.ArchiveLimitExceeded):
+            self._extract({"a.srt": os.urandom(4096)}, max_archive_size=4096)
+
+    def test__members(self):
+
+        with self.assertRaises(opensub.ArchiveLimitExceeded):
+            self._extract(
+                {"a.srt": b"", "a.nfo": b"", "b.nfo": b""}, max_members=2)
+
+    def test__member_size(self):
+
+        """Stop decompressing at the limit, remove the partial file."""
+
+        with self.assertRaises(opensub.ArchiveLimitExceeded):
+            self._extract({"a.srt": b"x" * 1024 * 1024}, max_member_size=4096)
+
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def _open_bomb(self, archive):
+
+        """Returns: first subtitle of a small zip decompressing to 64MB."""
+
+        if archive.tempfile is None:
+            path = join(self.dir, "bomb.zip")
+            with open(path, "wb") as file_:
+                file_.write(_zip({"a.srt": b"\n" * 64 * 1024 * 1024}))
+            archive.tempfile = open(path, "rb")
+        # keep the generator, it closes the member when collected
+        self.opened = archive.yield_open()
+        return next(self.opened)
+
+    # ZipExtFile.tell() is python 3 only
+    @unittest.skipUnless(sys.version_info >= (3,), "needs python 3")
+    def test__read_everything(self):
+
+        """Decompress no more than the limit even if asked for all."""
+
+        with opensub.SubtitleArchive(
+                url=None, max_member_size=4096) as archive:
+            file_ = self._open_bomb(archive)
+            with self.assertRaises(opensub.ArchiveLimitExceeded):
+                file_.read()
+            self.assertLessEqual(file_.file_.tell(), 4097)
+
+    def test__read_lines(self):
+
+        with opensub.SubtitleArchive(
+                url=None, max_member_size=4096) as archive:
+            with self.assertRaises(opensub.ArchiveLimitExceeded):
+                self._open_bomb(archive).readlines()
+            with self.assertRaises(opensub.ArchiveLimitExceeded):
+                for _line in self._open_bomb(archive):
+                    pass
+
+
+class Caches(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def _caches(self):
+
+        return [
+            opensub.open_cache("memory"),
+            opensub.open_cache("sqlite:" + join(self.dir, "cache.sqlite")),
+            opensub.open_cache("dir:" + join(self.dir, "cache")),
+            ]
+
+    def test__get_set(self):
+
+        for cache in self._caches():
+            self.assertIsNone(cache.get("key"))
+            cache.set("key", b"value\0")
+            self.assertEqual(cache.get("key"), b"value\0")
+            cache.set("key", b"other")
+            self.assertEqual(cache.get("key"), b"other")
+
+    def test__lru(self):
+
+        cache = opensub.MemoryCache(max_items=2)
+        cache.set("a", b"a")
+        cache.set("b", b"b")
+        cache.get("a")
+        cache.set("c", b"c")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"a")
+
+    def test__shared_directory(self):
+
+        """Visible to other instances, no temporary files left behind."""
+
+        root = join(self.dir, "cache")
+        opensub.DirectoryCache(root).set("key", b"value")
+
+        self.assertEqual(opensub.DirectoryCache(root).get("key"), b"value")
+        files = [name for _, _, names in os.walk(root) for name in names]
+        self.assertEqual(len(files), 1)
+
+    def test__shared_directory_errors(self):
+
+        """Entries readable by others, I/O errors taken as misses."""
+
+        cache = opensub.DirectoryCache(join(self.dir, "cache"))
+        cache.set("key", b"value")
+        self.assertEqual(os.stat(cache._path("key")).st_mode & 0o777, 0o644)
+
+        os.makedirs(cache._path("broken"))
+        cache.set("broken", b"value")
+        self.assertIsNone(cache.get("broken"))
+
+    def test__invalid_spec(self):
+
+        with self.assertRaises(ValueError):
+            opensub.open_cache("redis:localhost")
+
+    def test__search_and_archive(self):
+
+        """Search and download once, even with new UserAgent objects."""
+
+        cache = opensub.DirectoryCache(join(self.dir, "cache"))
+
+        with StandInMovie() as sim:
+            urls = list()
+            for _ in range(2):
+                user_agent = opensub.UserAgent(
+                    server=sim.server.host, opener=sim.opener, cache=cache)
+                results = user_agent.search(movie=sim.movie, language="eng")
+                urls.append([result.url for result in results])
+
+                with opensub.SubtitleArchive(
+                    url=sim.archive_url(),
+                    opener=sim.opener,
+                    cache=cache) as archive:
+
+                    count = archive.extract(
+                        movie=sim.movie,
+                        builder=opensub.FilenameBuilder(),
+                        overwrite=True,
+                        )
+                    self.assertEqual(count, 2)
+
+            paths = [path for _, path, _ in sim.server.requests]
+
+        self.assertEqual(urls[0], urls[1])
+        self.assertEqual(
+            paths, [sim.search_path(), "/en/download/subad/4130212"])
+
+    def test__search_expires(self):
+
+        """Search again once the cached page is older than search_ttl."""
+
+        cache = opensub.MemoryCache()
+
+        with StandInMovie() as sim:
+            user_agent = opensub.UserAgent(
+                server=sim.server.host, opener=sim.opener, cache=cache,
+                search_ttl=60)
+            user_agent.search(movie=sim.movie, language="eng")
+            user_agent.search(movie=sim.movie, language="eng")
+
+            key, = [key for key in cache._items if key.startswith("search:")]
+            _, _, page = cache.get(key).partition(b"\n")
+            stamp = "{:.0f}\n".format(time.time() - 120).encode("ascii")
+            cache.set(key, stamp + page)
+            results = user_agent.search(movie=sim.movie, language="eng")
+
+            paths = [path for _, path, _ in sim.server.requests]
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(paths, [sim.search_path()] * 2)
+
+
+class Store(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.store = opensub.ContentStore(join(self.dir, "store"))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def _extract(self, sim, template, overwrite=False):
+
+        with opensub.SubtitleArchive(
+            url=sim.archive_url(), opener=sim.opener) as archive:
+
+            return archive.extract(
+                movie=sim.movie,
+                builder=opensub.FilenameBuilder(template),
+                overwrite=overwrite,
+                store=self.store,
+                )
+
+    def test__hardlink_copies(self):
+
+        """Same subtitles written twice are one file in the store."""
+
+        with StandInMovie() as sim:
+            os.mkdir(join(self.dir, "a"))
+            os.mkdir(join(self.dir, "b"))
+            for sub_dir in ("a", "b"):
+                template = join(
+                    self.dir, sub_dir, "{video/base}{subtitle/ext}")
+                self.assertEqual(self._extract(sim, template), 2)
+
+        first = os.stat(join(self.dir, "a", "movie-cd1.srt"))
+        second = os.stat(join(self.dir, "b", "movie-cd1.srt"))
+        self.assertEqual(first.st_ino, second.st_ino)
+        self.assertEqual(first.st_nlink, 3)
+
+    def test__refuse_to_overwrite(self):
+
+        with StandInMovie() as sim:
+            template = join(self.dir, "{video/base}{subtitle/ext}")
+            path = join(self.dir, "movie-cd1.srt")
+            with open(path, "wb") as file_:
+                file_.write(b"mine")
+
+            self.assertEqual(self._extract(sim, template), 1)
+            with open(path, "rb") as file_:
+                self.assertEqual(file_.read(), b"mine")
+
+            self.assertEqual(self._extract(sim, template, overwrite=True), 2)
+            with open(path, "rb") as file_:
+                self.assertNotEqual(file_.read(), b"mine")
+
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            ["movie-cd1.srt", "movie-cd2.srt", "store"])
+
+    def test__copy_across_filesystems(self):
+
+        """Copy when hardlinks fail, e.g. with EXDEV."""
+
+        src = self.store.put(io.BytesIO(b"content"))
+        dst = join(self.dir, "copy.srt")
+
+        original_link = os.link
+
+        def link(*_args):
+            raise OSError(errno.EXDEV, "cross-device link")
+        os.link = link
+        try:
+            self.store.link(src, dst, overwrite=True)
+        finally:
+            os.link = original_link
+
+        self.assertNotEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+        with open(dst, "rb") as file_:
+            self.assertEqual(file_.read(), b"content")
+
+    def test__copy_without_hardlinks(self):
+
+        """Copy when the filesystem has no hardlinks, without overwriting."""
+
+        src = self.store.put(io.BytesIO(b"content"))
+        dst = join(self.dir, "copy.srt")
+
+        original_link = os.link
+
+        def link(*_args):
+            raise OSError(errno.EPERM, "operation not permitted")
+        os.link = link
+        try:
+            self.store.link(src, dst)
+            with self.assertRaises(OSError) as raised:
+                self.store.link(src, dst)
+        finally:
+            os.link = original_link
+
+        self.assertEqual(raised.exception.errno, errno.EEXIST)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["copy.srt", "store"])
+        with open(dst, "rb") as file_:
+            self.assertEqual(file_.read(), b"content")
+
+
+class ExtractMany(unittest.TestCase):
+
+    @unittest.skipUnless(sys.version_info >= (3,), "needs python 3")
+    def test__processes(self):
+
+        """Extract in worker processes, report errors per archive."""
+
+        with StandInMovie() as sim:
+            os.mkdir(join(sim.dir, "a"))
+            os.mkdir(join(sim.dir, "b"))
+            tasks = [
+                (sim.archive_url(), sim.movie,
+                 join(sim.dir, "a", "{video/base}{subtitle/ext}"), False),
+                (sim.server.url("/no-such-archive"), sim.movie,
+                 "{video/dir}{video/base}{subtitle/ext}", False),
+                (sim.archive_url(), sim.movie,
+                 join(sim.dir, "b", "{video/base}{subtitle/ext}"), False),
+                ]
+
+            results = list(opensub.extract_many(tasks, processes=2))
+
+        self.assertEqual([result[0] for result in results], tasks)
+        self.assertEqual(results[0][1:], (
+            [join(sim.dir, "a", "movie-cd1.srt"),
+             join(sim.dir, "a", "movie-cd2.srt")], None))
+        self.assertEqual(results[1][1], [])
+        self.assertIn("404", str(results[1][2]))
+        self.assertEqual(len(results[2][1]), 2)
+
+
 class LookIntoArchive(unittest.TestCase):
 
     def test__extract_filenames_from_zip(self):
@@ -249,5 +1145,64 @@ class BinaryStdoutTestCase(unittest.TestCase):
             self.fail("couldn't write binary data")
 
 
+class Profiling(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.profile = join(self.dir, "profile")
+
+    def tearDown(self):
+
+        opensub.profiling.stop()
+        shutil.rmtree(self.dir)
+
+    def _profiled_functions(self):
+
+        return [func[2] for func in pstats.Stats(self.profile).stats]
+
+    def test__entry_points(self):
+
+        """Profile calls of entry points only."""
+
+        opensub.profiling.start(profile=self.profile)
+        opensub.FilenameBuilder().build(video="v.avi", subtitle="s.srt")
+        opensub.profiling.stop()
+
+        functions = self._profiled_functions()
+        self.assertIn("build", functions)
+        self.assertIn("_split_dir_base_ext", functions)
+
+    def test__environment(self):
+
+        """Profile via environment variables."""
+
+        env = dict(os.environ)
+        env["OPENSUB_PROFILE"] = self.profile
+        subprocess.check_call(
+            [sys.executable, "-c",
+             "import opensub; "
+             "opensub.FilenameBuilder().build(video='v', subtitle='s')"],
+            env=env,
+            cwd=join(os.path.dirname(__file__), os.pardir, "lib"),
+            )
+
+        self.assertIn("build", self._profiled_functions())
+
+    def test__invalid_environment(self):
+
+        """Ignore a malformed OPENSUB_TRACE_MALLOC instead of failing."""
+
+        env = dict(os.environ)
+        env["OPENSUB_TRACE_MALLOC"] = "yes"
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(
+                [sys.executable, "-c", "import opensub"],
+                env=env,
+                cwd=join(os.path.dirname(__file__), os.pardir, "lib"),
+                stderr=devnull,
+                )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,216 @@
+"""
+Performance regression tests, skipped unless enabled:
+
+    OPENSUB_PERF=perf-results.json python -m pytest test/test_perf.py
+
+Each workload is timed (best of a few runs) and the time is stored in the
+JSON file under the current git commit, next to those of earlier commits:
+
+    {"<commit>": {"<workload>": seconds, ...}, ...}
+
+Uncommitted changes are stored under "<commit>+dirty" instead, so they
+never pass for the commit itself.
+
+A workload fails if it's slower than OPENSUB_PERF_TOLERANCE (default 1.25)
+times its time at the baseline commit: OPENSUB_PERF_BASELINE (a commit,
+branch, tag or key of the file) if set, otherwise the current commit for
+uncommitted changes and its parent for a clean tree. Nothing is compared
+until the baseline has been run. Keep the file out of the repo and compare
+on the same machine only.
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+from os.path import join
+
+# Make it possible to run out of the working copy.
+sys.path.insert(0,
+    os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "lib",
+        ))
+
+import opensub
+import opensub.main
+
+RESULTS_PATH = os.environ.get("OPENSUB_PERF")
+TOLERANCE = float(os.environ.get("OPENSUB_PERF_TOLERANCE") or 1.25)
+BASELINE = os.environ.get("OPENSUB_PERF_BASELINE")
+REPEAT = 3
+
+
+def _test_data(name):
+
+    return join(os.path.dirname(__file__), "test-data", name)
+
+
+def _git(*args):
+
+    """Returns: output of git, None if it fails."""
+
+    try:
+        return subprocess.check_output(
+            ("git",) + args,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _commits():
+
+    """Returns: (key of the results, key of the baseline results)."""
+
+    head = _git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(_git("status", "--porcelain", "--untracked-files=no"))
+
+    if BASELINE:
+        baseline = _git("rev-parse", "--short", BASELINE) or BASELINE
+    elif dirty:
+        baseline = head
+    else:
+        baseline = _git("rev-parse", "--short", "HEAD^")
+
+    return head + "+dirty" if dirty else head, baseline
+
+
+def _best_time(func):
+
+    best = None
+    for _ in range(REPEAT):
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+@unittest.skipUnless(RESULTS_PATH, "set OPENSUB_PERF to enable")
+class Perf(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def _record(self, workload, func):
+
+        """Time func, store the result, compare it to the baseline."""
+
+        seconds = _best_time(func)
+        commit, baseline = _commits()
+
+        try:
+            with open(RESULTS_PATH) as file_:
+                results = json.load(file_)
+        except (IOError, OSError, ValueError):
+            results = dict()
+
+        results.setdefault(commit, dict())[workload] = round(seconds, 6)
+
+        with open(RESULTS_PATH + ".tmp", "w") as file_:
+            json.dump(results, file_, indent=2, sort_keys=True)
+        os.rename(RESULTS_PATH + ".tmp", RESULTS_PATH)
+
+        baseline_seconds = results.get(baseline, dict()).get(workload)
+        if baseline_seconds is not None and baseline != commit:
+            limit = baseline_seconds * TOLERANCE
+            self.assertLessEqual(
+                seconds, limit,
+                "{} regressed since {}: {:.3f}s > {:.3f}s".format(
+                    workload, baseline, seconds, limit))
+
+    def test__hash_files(self):
+
+        paths = list()
+        for num in range(200):
+            path = join(self.dir, "video{}.avi".format(num))
+            with open(path, "wb") as file_:
+                file_.write(os.urandom(256 * 1024))
+            paths.append(path)
+
+        def hash_all():
+            for _, _, error in opensub.hash_files(paths):
+                self.assertIsNone(error)
+
+        self._record("hash_files", hash_all)
+
+    def test__hash_stream(self):
+
+        data = os.urandom(16 * 1024 * 1024)
+
+        def hash_many():
+            for _ in range(10):
+                opensub.hash_stream(io.BytesIO(data))
+
+        self._record("hash_stream", hash_many)
+
+    def test__parse_search_page(self):
+
+        with open(_test_data("search.xml"), "rb") as file_:
+            page = file_.read()
+
+        def parse():
+            for _ in range(500):
+                parser = opensub.main._SearchPageParser()
+                parser.feed(page)
+                for result in parser.close():
+                    result.rating
+
+        self._record("parse_search_page", parse)
+
+    def _extract(self, archive_path, movie, count):
+
+        for num in range(count):
+            with open(archive_path, "rb") as archive_file:
+                with opensub.SubtitleArchive(url=None) as archive:
+                    archive.tempfile = archive_file
+                    archive.extract(
+                        movie=movie,
+                        builder=opensub.FilenameBuilder(
+                            join(self.dir, "{}-{{num}}".format(num))),
+                        overwrite=True,
+                        )
+                    archive.tempfile = None
+
+    def test__extract_test_data(self):
+
+        movie = [join(self.dir, "movie-cd1.avi"),
+                 join(self.dir, "movie-cd2.avi")]
+
+        self._record(
+            "extract_4130212",
+            lambda: self._extract(_test_data("4130212.zip"), movie, 100))
+
+    def test__extract_synthetic(self):
+
+        archive_path = join(self.dir, "synthetic.zip")
+        line = b"00:00:01,000 --> 00:00:02,000\nSome words of dialogue.\n\n"
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zip_:
+            for num in range(20):
+                zip_.writestr("sub{:02}.srt".format(num), line * 20000)
+
+        movie = [join(self.dir, "movie{:02}.avi".format(num))
+                 for num in range(20)]
+
+        self._record(
+            "extract_synthetic",
+            lambda: self._extract(archive_path, movie, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()